@@ -0,0 +1,27 @@
+"""Per call overhead of assertTypes, compared to calling the undecorated function.
+
+    python benchmarks/assert_types.py
+"""
+import timeit
+from utils3 import assertTypes
+
+
+def target(a: int, b: float = 1.0, *, c: str = ""):
+    return a
+
+
+annotated = assertTypes()(target)
+listed = assertTypes([int, float])(target)
+
+
+def measure(func, number=200000) -> float:
+    """Best of 5 runs, in nanoseconds per call"""
+    return min(timeit.repeat(lambda: func(1, 2.0, c="x"), number=number, repeat=5)) / number * 1e9
+
+
+if __name__ == "__main__":
+    bare = measure(target)
+    print("{:<28} {:>8.0f} ns".format("undecorated", bare))
+    for name, func in (("assertTypes() annotations", annotated), ("assertTypes([int, float])", listed)):
+        elapsed = measure(func)
+        print("{:<28} {:>8.0f} ns  (+{:.0f} ns)".format(name, elapsed, elapsed - bare))
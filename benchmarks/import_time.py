@@ -0,0 +1,77 @@
+"""Import time regression check for `import utils3`, based on `python -X importtime`.
+
+    python benchmarks/import_time.py [--budget-ms 30] [--runs 5]
+
+Fails (exit code 1) when one of the modules utils3 is supposed to load lazily gets imported,
+or when the best cumulative import time of utils3 over the runs exceeds the budget."""
+import os
+import sys
+import argparse
+import subprocess
+
+# Modules `import utils3` must not pull in
+LAZY_MODULES = [
+    "subprocess", "inspect", "tempfile", "threading", "shutil", "asyncio", "base64", "random",
+    "utils3.system", "utils3.timing", "utils3.probes", "utils3.profiling", "utils3.memo", "utils3.plot",
+    "utils3.containers",
+]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importTime(module: str = "utils3") -> (int, {str: int}):
+    """Cumulative import time of a module in microseconds, and the self time of every module it imported"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            env=env, stderr=subprocess.PIPE, check=True, text=True).stderr
+
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(self_us), int(cumulative_us)))
+
+    # A module's nested imports are the deeper indented lines right above it. Only those count, modules the
+    # interpreter already loaded at startup (site, .pth hooks) aren't imported by the module.
+    imported = {}
+    cumulative = None
+    for index, (indent, name, self_us, cumulative_us) in enumerate(entries):
+        if name != module:
+            continue
+        cumulative = cumulative_us
+        imported[name] = self_us
+        for nested_indent, nested_name, nested_self_us, _ in reversed(entries[:index]):
+            if nested_indent <= indent:
+                break
+            imported[nested_name] = nested_self_us
+        break
+    return cumulative, imported
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=30.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    best = None
+    imported = {}
+    for _ in range(args.runs):
+        cumulative, imported = importTime()
+        best = cumulative if best is None else min(best, cumulative)
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print("Imported eagerly: {}".format(", ".join(eager)))
+        failed = True
+
+    print("import utils3: {:.1f} ms (budget {:.1f} ms)".format(best / 1000, args.budget_ms))
+    if best / 1000 > args.budget_ms:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
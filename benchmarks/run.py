@@ -0,0 +1,375 @@
+"""Benchmark suite for the utils3 hot paths. Runs offline, servers are local sockets and a local HTTP server.
+
+    python benchmarks/run.py run [--output results.json] [--only plot,decorators] [--quick]
+    python benchmarks/run.py compare baseline.json results.json [--threshold 0.1]
+
+Every metric is the best time per operation in seconds over several repeats, lower is better.
+compare exits with code 1 when a metric got slower than the threshold allows."""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import functools
+import http.server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils3  # noqa: E402
+
+BENCHMARKS = {}
+
+# Scales iteration counts, --quick lowers it
+SCALE = 1.0
+
+
+def benchmark(group: str):
+    """Register a benchmark function returning {metric: seconds per operation}"""
+    def register(func):
+        BENCHMARKS.setdefault(group, []).append(func)
+        return func
+
+    return register
+
+
+def measure(func, number: int, repeat: int = 5) -> float:
+    """Best time per call of func() over the repeats, in seconds"""
+    number = max(1, int(number * SCALE))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class _Scratch:
+    """A temporary directory for a benchmark"""
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix="utils3-bench-")
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# Networking
+def _echo(client, address, data):
+    client.sendall(data)
+
+
+def _accept_until_stopped(server):
+    try:
+        server.start()
+    except OSError:
+        # accept() fails once stop() closes the listening socket
+        pass
+
+
+def _serve(server):
+    thread = threading.Thread(target=_accept_until_stopped, args=(server,), daemon=True)
+    thread.start()
+    time.sleep(0.05)
+    return thread
+
+
+def _stop(server):
+    try:
+        server.stop()
+    except (AssertionError, OSError):
+        # Handler threads of closed clients may still be winding down
+        pass
+
+
+def _round_trips(client, payload: bytes, count: int) -> float:
+    def round_trip():
+        client.sendall(payload)
+        received = 0
+        while received < len(payload):
+            received += len(client.recv(65536))
+
+    return measure(round_trip, count)
+
+
+@benchmark("networking")
+def bench_server():
+    from utils3.networking.sockets import Server, UDSServer
+
+    results = {}
+    server = Server(lambda client, address: None, "127.0.0.1", 0, on_recv=_echo)
+    _serve(server)
+    client = socket.create_connection(server.socket.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    results["Server.echo_64B"] = _round_trips(client, b"x" * 64, 500)
+    results["Server.echo_1KB"] = _round_trips(client, b"x" * 1000, 500)
+    client.close()
+    _stop(server)
+
+    with _Scratch() as scratch:
+        path = os.path.join(scratch, "bench.sock")
+        server = UDSServer(lambda client, address: None, path, on_recv=_echo)
+        _serve(server)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        results["UDSServer.echo_64B"] = _round_trips(client, b"x" * 64, 500)
+        client.close()
+        _stop(server)
+
+    def connect():
+        socket.create_connection(address).close()
+
+    server = Server(lambda client, address: None, "127.0.0.1", 0, on_connect=lambda client, address: client.close())
+    _serve(server)
+    address = server.socket.getsockname()
+    results["Server.connect"] = measure(connect, 200)
+    _stop(server)
+    return results
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@benchmark("networking")
+def bench_download():
+    try:
+        from utils3.networking import Session
+    except ImportError as e:
+        print("  skipped Session.downloadFile: {}".format(e))
+        return {}
+
+    results = {}
+    with _Scratch() as scratch:
+        for size in (1 << 20, 16 << 20):
+            with open(os.path.join(scratch, "{}.bin".format(size)), "wb") as f:
+                f.write(os.urandom(size))
+
+        handler = functools.partial(_QuietHandler, directory=scratch)
+        httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        session = Session()
+        target = os.path.join(scratch, "download")
+        try:
+            for size in (1 << 20, 16 << 20):
+                url = "http://127.0.0.1:{}/{}.bin".format(httpd.server_address[1], size)
+                results["Session.downloadFile_{}MB".format(size >> 20)] = measure(
+                    lambda: session.downloadFile(url, target, lambda progress: None), 5, repeat=3)
+        finally:
+            httpd.shutdown()
+    return results
+
+
+# System
+@benchmark("system")
+def bench_processes():
+    from utils3.system import allProcesses
+
+    return {"allProcesses": measure(allProcesses, 10)}
+
+
+@benchmark("system")
+def bench_paths():
+    from utils3.system.paths import Path
+
+    with _Scratch() as scratch:
+        for i in range(1000):
+            open(os.path.join(scratch, "file{}".format(i)), "w").close()
+        directory = Path(scratch)
+        return {
+            "Path.files_1000": measure(directory.files, 20),
+            "Path.files_1000_relative": measure(lambda: directory.files(absolute=False), 50),
+            "Path.join": measure(lambda: directory.join("a", "b", modify=False), 2000),
+        }
+
+
+@benchmark("system")
+def bench_containers():
+    from utils3.containers import ContainerPool
+
+    def use(container):
+        with container as path:
+            for i in range(20):
+                open(os.path.join(path.path, "file{}".format(i)), "w").close()
+
+    with _Scratch() as scratch:
+        cwd = os.getcwd()
+        os.chdir(scratch)
+        try:
+            results = {"Container": measure(lambda: use(utils3.Container()), 200)}
+        finally:
+            os.chdir(cwd)
+    with ContainerPool() as pool:
+        results["Container_pooled"] = measure(lambda: use(utils3.Container(pool=pool)), 200)
+    return results
+
+
+# JSON
+@benchmark("js")
+def bench_js():
+    from utils3.js import JsHandler
+
+    results = {}
+    with _Scratch() as scratch:
+        for size in (100, 10000, 100000):
+            file_name = os.path.join(scratch, "{}.json".format(size))
+            handler = JsHandler.from_dict({"key{}".format(i): [i, str(i), {"v": i}] for i in range(size)}, file_name)
+            number = max(1, 20000 // size)
+            results["JsHandler.save_{}".format(size)] = measure(handler.save, number, repeat=3)
+            results["JsHandler.load_{}".format(size)] = measure(lambda: JsHandler(file_name), number, repeat=3)
+    return results
+
+
+# Plot
+@benchmark("plot")
+def bench_plot():
+    from utils3.plot import PrimitivePlotWriter, RingPlotWriter
+
+    results = {}
+    with _Scratch() as scratch:
+        writer = PrimitivePlotWriter(os.path.join(scratch, "unbuffered.plt"))
+        results["PrimitivePlotWriter.write_xy"] = measure(lambda: writer.write_xy(1, 0.5), 2000)
+
+        with PrimitivePlotWriter(os.path.join(scratch, "buffered.plt"), buffered=True) as writer:
+            results["PrimitivePlotWriter.write_xy_buffered"] = measure(lambda: writer.write_xy(1, 0.5), 50000)
+            xs, ys = list(range(10000)), [0.5] * 10000
+            results["PrimitivePlotWriter.write_xy_many_10000"] = measure(lambda: writer.write_xy_many(xs, ys), 20)
+
+        with RingPlotWriter(os.path.join(scratch, "ring.plt"), capacity=1 << 16) as writer:
+            results["RingPlotWriter.write_xy"] = measure(lambda: writer.write_xy(1, 0.5), 50000)
+    return results
+
+
+# Decorators
+def _target(a, b=1):
+    return a
+
+
+def _typed_target(a: int, b: int = 1):
+    return a
+
+
+@benchmark("decorators")
+def bench_decorators():
+    from utils3.probes import SamplingProbe
+
+    decorated = {
+        "undecorated": _target,
+        "probe": utils3.probe(lambda results: None)(_target),
+        "SamplingProbe_1in100": SamplingProbe(lambda batch: None, every=100, batch_interval=0.1)(_target),
+        "assertTypes_list": utils3.assertTypes([int, int])(_target),
+        "assertTypes_annotations": utils3.assertTypes()(_typed_target),
+        "redundancy": utils3.redundancy(_target)(_target),
+        "redundancy_hedged": utils3.redundancy(_target, hedge_delay=1.0)(_target),
+        "timed": utils3.timed("bench")(_target),
+    }
+    results = {}
+    for name, func in decorated.items():
+        number = 500 if name == "redundancy_hedged" else 20000
+        results["decorator.{}".format(name)] = measure(lambda: func(1, b=2), number)
+    return results
+
+
+# Import
+@benchmark("import")
+def bench_import():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from import_time import importTime
+
+    best = min(importTime()[0] for _ in range(5))
+    return {"import utils3": best / 1e6}
+
+
+# Command line
+def run(groups, output):
+    results = {}
+    for group, benchmarks in BENCHMARKS.items():
+        if groups and group not in groups:
+            continue
+        for func in benchmarks:
+            print("{}.{}".format(group, func.__name__))
+            for metric, seconds in func().items():
+                results[metric] = seconds
+                print("  {:<45} {:>12.3f} us/op".format(metric, seconds * 1e6))
+
+    document = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scale": SCALE,
+        },
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(document, f, indent=4)
+        print("Saved to {}".format(output))
+
+
+def compare(baseline_file, current_file, threshold) -> int:
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+    with open(current_file) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    print("{:<45} {:>12} {:>12} {:>8}".format("metric", "baseline us", "current us", "change"))
+    for metric in sorted(set(baseline) | set(current)):
+        if metric not in baseline or metric not in current:
+            print("{:<45} {:>12} {:>12}".format(metric, "-" if metric not in baseline else "",
+                                                "-" if metric not in current else ""))
+            continue
+        change = current[metric] / baseline[metric] - 1 if baseline[metric] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  improved"
+        print("{:<45} {:>12.3f} {:>12.3f} {:>+7.1f}%{}".format(
+            metric, baseline[metric] * 1e6, current[metric] * 1e6, change * 100, flag))
+
+    print("{} regression(s) above {:.0f}%".format(regressions, threshold * 100))
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    global SCALE
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", "-o", help="JSON file to save the results to")
+    run_parser.add_argument("--only", help="Comma separated groups: {}".format(", ".join(BENCHMARKS)))
+    run_parser.add_argument("--quick", action="store_true", help="Fewer iterations, noisier results")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Relative slowdown reported as a regression (default 0.1 = 10%%)")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args.baseline, args.current, args.threshold)
+
+    if args.quick:
+        SCALE = 0.1
+    run(set(args.only.split(",")) if args.only else None, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
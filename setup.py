@@ -8,5 +8,8 @@ setup(
     author_email="lhu9mbim@duck.com",
     requires=[
         "requests",
-    ]
+    ],
+    extras_require={
+        "plot": ["numpy"],
+    }
 )
@@ -3,18 +3,53 @@ import os
 import io
 import sys
 import time
-import base64
-import random
-import shutil
-import inspect
-import tempfile
-import traceback
-import threading
-import subprocess
-from utils3.system import paths
+import importlib
+import functools
+from utils3.callsites import CallSiteCounter, codeInfo
+
+# Heavier modules are only imported when they are used, `import utils3` stays cheap for short-lived CLI tools.
+# Names re-exported from submodules are loaded on first access by __getattr__ (PEP 562).
+_lazy_attributes = {
+    'paths': 'utils3.system',
+    'timers': 'utils3.timing',
+    'timed': 'utils3.timing',
+    'TimerRegistry': 'utils3.timing',
+    'SamplingProbe': 'utils3.probes',
+    'CallRecord': 'utils3.probes',
+    'profile': 'utils3.profiling',
+    'profileFor': 'utils3.profiling',
+    'memoize': 'utils3.memo',
+    'ContainerPool': 'utils3.containers',
+}
+_lazy_submodules = {
+    'callsites', 'containers', 'executors', 'hedging', 'js', 'memo', 'networking', 'plot', 'probes', 'profiling',
+    'system', 'timing', 'typecheck',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        module = importlib.import_module(_lazy_attributes[name])
+        try:
+            value = getattr(module, name)
+        except AttributeError:
+            # A submodule that isn't imported by its package
+            value = importlib.import_module(module.__name__ + '.' + name)
+    elif name in _lazy_submodules:
+        value = importlib.import_module('utils3.' + name)
+    else:
+        raise AttributeError("module 'utils3' has no attribute '{}'".format(name))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes) | _lazy_submodules)
+
 
 # Store reference to any subprocesses, so they can all be terminated when an error is thrown
-_processes: [subprocess.Popen] = []
+_processes: list = []
 
 
 # Terminate Wrapper
@@ -39,10 +74,11 @@ def playAudio(file, type_=0):
 
 def whoCalledMe() -> (str, str):
     """The file the called this function and the name of the function"""
-    return inspect.stack()[1][1], inspect.stack()[1][3]
+    return codeInfo(sys._getframe(1).f_code)
 
 def probe(result_callback: callable):
     """Probe a function to see it's args, kwargs, errors, return value, traceback and execution time.
+    Every call is probed and errors are swallowed, for production code use SamplingProbe.
 
     :param result_callback: The function to call with the results of the probe, the result will be a dict
         like this:
@@ -59,41 +95,53 @@ def probe(result_callback: callable):
             }
 
     """
-    probe_results = {
-        'args': [],
-        'kwargs': {},
-        'error': Exception('No Error'),
-        'return': None,
-        'time_taken': None,
-        'traceback': str()
-    }
-
-    def _time_taken(t):
-        probe_results['time_taken'] = t
-
     def probe_decorator(func):
         def probe_wrapper(*args, **kwargs):
-            probe_results['args'] = list(args)
-            probe_results['kwargs'] = kwargs
+            # A new dict per call, concurrent calls don't overwrite each other's results
+            probe_results = {
+                'args': list(args),
+                'kwargs': kwargs,
+                'error': Exception('No Error'),
+                'return': None,
+                'time_taken': None,
+                'traceback': str()
+            }
+
+            def _time_taken(t):
+                probe_results['time_taken'] = t
+
             with Timer(_time_taken):
                 try:
                     probe_results['return'] = func(*args, **kwargs)
                 except Exception as e:
+                    import traceback
+
                     probe_results['error'] = e
                     probe_results['traceback'] = traceback.format_exc()
             result_callback(probe_results)
+            return probe_results['return']
 
         return probe_wrapper
 
     return probe_decorator
 
-def redundancy(redundancy_function: callable):
+def redundancy(redundancy_function: callable, hedge_delay=None, retries: int = 0, breaker=None, **kwargs):
     """
     Redundancy decorator, if the function fails, it will call the redundancy function.
 
     :param redundancy_function: The function to call if the wrapped function fails
+    :param hedge_delay: Also call the redundancy function when the wrapped function hasn't returned within this many
+        seconds, the first result wins. "auto" learns the delay from the p95 latency of the wrapped function.
+    :param retries: Retry the wrapped function this many times, with jittered exponential backoff, before falling back
+    :param breaker: A utils3.hedging.CircuitBreaker, skips the wrapped function while it keeps failing
+    :param kwargs: Further options of utils3.hedging.hedge (backoff, max_backoff, percentile)
     :return: A decorator that will call the redundancy function if the wrapped function fails
     """
+    if hedge_delay is not None or retries or breaker is not None or kwargs:
+        from utils3.hedging import hedge
+
+        return hedge(redundancy_function, hedge_delay=hedge_delay, retries=retries, breaker=breaker, **kwargs)
+
     def decorator(function):
         def wrapper(*args, **kwargs):
             try:
@@ -108,22 +156,164 @@ def redundancy(redundancy_function: callable):
 
 def base64File(file_path):
     """Return the base64 encoded contents of a file"""
+    import base64
+
     with open(file_path, 'rb') as f:
         return base64.b64encode(f.read())
 
 def base64DecodeFile(file_path, data):
     """Decode base64 data and write it to a file"""
+    import base64
+
     with open(file_path, 'wb') as f:
         f.write(base64.b64decode(data))
 
-def assertTypes(types: [type], auto_convert=True, class_method=False):
+# Raw bytes read per step of the streaming base64 functions, a multiple of 3 and of 4
+_BASE64_CHUNK = 3 * 4 * 64 * 1024
+
+# Default directory of BinaryDecompression(cache=True)
+_BINARY_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                             'utils3', 'binaries')
+
+def _iterSource(source, chunk_size, use_mmap=False):
+    """Yield chunks of a file path, a file object or an iterable of bytes/str chunks"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if use_mmap:
+                import mmap
+
+                try:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty files can't be mapped
+                    return
+                with mapped:
+                    # Slices are copies, so no view keeps the mapping from closing
+                    for start in range(0, len(mapped), chunk_size):
+                        yield mapped[start:start + chunk_size]
+                return
+            yield from _iterSource(f, chunk_size)
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    else:
+        yield from source
+
+def iterBase64Encode(source, line_length: int = None, chunk_size: int = _BASE64_CHUNK, use_mmap: bool = False):
+    """
+    Base64 encode a file or stream chunk by chunk, memory use stays around chunk_size regardless of the input size
+
+    :param source: A file path, a binary file object, bytes or an iterable of bytes chunks
+    :param line_length: Split the output into lines of this many characters ending with b"\\n", 76 for MIME.
+        None yields one continuous encoding like base64File.
+    :param chunk_size: Bytes read per step
+    :param use_mmap: Read a file path through mmap instead of read() calls
+    :return: A generator of encoded bytes chunks
+    """
+    import base64
+
+    assert line_length is None or (line_length > 0 and line_length % 4 == 0), \
+        "line_length must be a positive multiple of 4"
+    # Only whole 3 byte groups are encoded before the end, so no padding appears mid stream
+    chunk_size = max(3, chunk_size - chunk_size % 3)
+    remainder = b''
+    pending = b''
+
+    def lines(encoded, final):
+        nonlocal pending
+        if line_length is None:
+            return encoded
+        encoded = pending + encoded
+        end = len(encoded) if final else len(encoded) - len(encoded) % line_length
+        pending = encoded[end:]
+        return b''.join(encoded[start:start + line_length] + b'\n' for start in range(0, end, line_length))
+
+    for chunk in _iterSource(source, chunk_size, use_mmap=use_mmap):
+        if remainder:
+            chunk = remainder + chunk
+        usable = len(chunk) - len(chunk) % 3
+        remainder = bytes(chunk[usable:])
+        if usable:
+            output = lines(base64.b64encode(chunk[:usable]), False)
+            if output:
+                yield output
+    output = lines(base64.b64encode(remainder), True)
+    if output:
+        yield output
+
+def iterBase64Decode(source, chunk_size: int = _BASE64_CHUNK):
+    """
+    Decode base64 chunk by chunk, whitespace and line breaks (e.g. MIME lines) are ignored
+
+    :param source: A file path, a file object (binary or text), bytes or an iterable of bytes/str chunks.
+        Chunks don't need to be aligned, a str is treated as a file path, wrap encoded text in a list.
+    :param chunk_size: Characters read per step
+    :return: A generator of decoded bytes chunks
+    """
+    import base64
+
+    remainder = b''
+    for chunk in _iterSource(source, chunk_size):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        # Strips the whitespace b64decode would otherwise only skip after copying
+        chunk = remainder + bytes(chunk).translate(None, b' \t\r\n\v\f')
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable])
+    if remainder:
+        # Raises binascii.Error for truncated input
+        yield base64.b64decode(remainder)
+
+def _writeChunks(chunks, destination) -> int:
+    written = 0
+    if isinstance(destination, (str, os.PathLike)):
+        with open(destination, 'wb') as f:
+            for chunk in chunks:
+                written += f.write(chunk)
+    else:
+        for chunk in chunks:
+            written += destination.write(chunk)
+    return written
+
+def base64EncodeStream(source, destination, line_length: int = None, chunk_size: int = _BASE64_CHUNK,
+                       use_mmap: bool = False) -> int:
+    """Streaming base64File, encode source (see iterBase64Encode) into a file path or binary file object.
+    Returns the number of bytes written."""
+    return _writeChunks(iterBase64Encode(source, line_length, chunk_size, use_mmap), destination)
+
+def base64DecodeStream(source, destination, chunk_size: int = _BASE64_CHUNK) -> int:
+    """Streaming base64DecodeFile, decode source (see iterBase64Decode) into a file path or binary file object.
+    Returns the number of bytes written."""
+    return _writeChunks(iterBase64Decode(source, chunk_size), destination)
+
+def assertTypes(types: [type] = None, auto_convert=True, class_method=False):
     """
     Guarantee that the types of the arguments of a function are correct
     :param class_method: If the decorator is being used on a class method, the first argument will be the class instance
-    :param types: A list of types, the length of the list must match the number of arguments
+    :param types: A list of types, one per positional argument, arguments beyond the list aren't checked.
+        Leave out (@assertTypes() or @assertTypes) to check the function's annotations instead: the checker is
+        built once at decoration time, handles positional, keyword and default arguments and costs one isinstance
+        per annotated argument on every call.
     :param auto_convert: If the types don't match, try to convert them
     :return:
     """
+    if types is None or callable(types) and not isinstance(types, type):
+        from utils3.typecheck import compileTypeChecker
+
+        if types is not None:
+            # Used as @assertTypes without arguments
+            return compileTypeChecker(types, auto_convert)
+        return lambda function: compileTypeChecker(function, auto_convert)
+
     def assertDecorator(function):
         def assertWrapper(*args, **kwargs):
             args = list(args)
@@ -132,7 +322,7 @@ def assertTypes(types: [type], auto_convert=True, class_method=False):
                 ref = args[0]
                 args = args[1:]
 
-            for i, arg in enumerate(args):
+            for i, arg in enumerate(args[:len(types)]):
                 if not isinstance(arg, types[i]):
                     if auto_convert:
                         try:
@@ -152,15 +342,54 @@ def assertTypes(types: [type], auto_convert=True, class_method=False):
     return assertDecorator
 
 def runAsThread(func):
-    """Run a function as a thread"""
+    """Run a function as a thread. Calls run on a shared pool of daemon threads (see
+    utils3.executors.configureExecutor) and return a Future with the result, which also supports join() and
+    is_alive(). The decorated function gets .map(*iterables, chunksize=1) to run many calls at once."""
+    from utils3 import executors
+
+    @functools.wraps(func)
     def thread_wrapper(*args, **kwargs):
-        thread = threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True)
-        thread.start()
-        return thread
+        return executors.submitThread(func, *args, **kwargs)
+
+    thread_wrapper.map = functools.partial(executors.threadMap, func)
     return thread_wrapper
 
+def runInProcess(func):
+    """Run a function in a shared process pool, for CPU bound work. Calls return a Future. The function must be
+    defined at module level, its arguments and result must be picklable. The decorated function gets
+    .map(*iterables, chunksize=1) to send many calls to the pool in chunks."""
+    from utils3 import executors
+
+    @functools.wraps(func)
+    def process_wrapper(*args, **kwargs):
+        return executors.submitProcess(process_wrapper, *args, **kwargs)
+
+    process_wrapper.__utils3_process__ = True
+    process_wrapper.map = functools.partial(executors.processMap, process_wrapper)
+    return process_wrapper
+
 
 # Classes
+def _lazyImport(module_name):
+    """Import a module with importlib.util.LazyLoader, it is executed on first attribute access"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    import importlib.util
+
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named '{}'".format(module_name), name=module_name)
+    if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+        return importlib.import_module(module_name)
+
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
 class ProxyModule:
     """ProxyModule is a class that allows you to only import the module when it's needed."""
 
@@ -169,41 +398,31 @@ class ProxyModule:
         self.module = None
 
     def __getattr__(self, name):
+        if name == 'module':
+            # Not set yet, don't recurse
+            raise AttributeError(name)
         if self.module is None:
-            self.module = __import__(self.module_name)
-            self._add_attributes()
+            self.module = _lazyImport(self.module_name)
 
-        return getattr(self.module, name)
-
-    def _add_attributes(self):
-        # check the module directory for other python files
-        # import them and add them to the module
-        # this is used to emulate the 'from' statement (for modules not classes)
         try:
-            module_dir = self.module.__path__[0]
+            return getattr(self.module, name)
         except AttributeError:
-            return
-        for file in os.listdir(module_dir):
-            if file.startswith('.') or file.startswith('__'):
-                continue
-            if not file.endswith('.py'):
-                continue
-
+            # emulate the 'from' statement for submodules of packages, only the submodule touched is imported
+            if not hasattr(self.module, '__path__'):
+                raise
+            submodule_name = self.module_name + '.' + name
             try:
-                getattr(self.module, file.split('.')[0])
-            except AttributeError:
-                # the file is not already imported
-                try:
-                    attrib = __import__(self.module_name + '.' + file.split('.')[0])
-                    setattr(self.module, file.split('.')[0], attrib)
-                except KeyError:
-                    pass
-                except ModuleNotFoundError:
-                    raise ModuleNotFoundError("Could not import {}".format(file.split('.')[0]))
+                submodule = _lazyImport(submodule_name)
+            except ModuleNotFoundError as e:
+                if e.name != submodule_name:
+                    raise
+                raise AttributeError("module '{}' has no attribute '{}'".format(self.module_name, name)) from None
+            setattr(self.module, name, submodule)
+            return submodule
 
 
 class Timer:
-    """Time how long it takes for a code block to execute"""
+    """Time how long it takes for a code block to execute. For aggregated statistics see utils3.timing"""
 
     def __init__(self, callback):
         """
@@ -212,10 +431,10 @@ class Timer:
         self.callback = callback
 
     def __enter__(self):
-        self.start = time.time()
+        self.start = time.perf_counter()
 
     def __exit__(self, *args):
-        self.end = time.time()
+        self.end = time.perf_counter()
         self.callback(self.end - self.start)
 
 
@@ -234,6 +453,9 @@ class Coffee:
         Note: A thread will be launched to make sure the caffeinate process is still running,
         THIS THREAD IS NOT A DAEMON THREAD, SO IT WILL NOT TERMINATE WHEN THE PROGRAM ENDS. THIS IS TO ENCOURAGE
         CALLING del ON THE COFFEE OBJECT WHEN IT IS NO LONGER NEEDED."""
+        import threading
+        import subprocess
+
         assert self._deleted is False, "This coffee has been deleted"
         self._process = subprocess.Popen(['caffeinate'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         _processes.append(self._process)
@@ -290,12 +512,31 @@ class Container:
     """A container is a temporary directory that gets created when using the 'with' statement.
     The directory is deleted when the 'with' statement ends. Within the 'with' statement, the
     current working directory is set to the container directory.
-    The __enter__ method returns the path in a Path object"""
+    The __enter__ method returns the path in a Path object
 
-    def __init__(self):
-        self._container = "." + random.randint(0, 9999999).__str__()
+    :param pool: A utils3.containers.ContainerPool, or True for the shared one. The directory then comes from the
+        pool (on /dev/shm when available), the working directory isn't changed, which makes containers safe to use
+        from several threads, and it's deleted in the background.
+    """
+
+    def __init__(self, pool=None):
+        if pool is True:
+            from utils3.containers import defaultPool
+
+            pool = defaultPool()
+        self._pool = pool
+        if pool is None:
+            import random
+
+            self._container = "." + random.randint(0, 9999999).__str__()
+
+    def __enter__(self) -> 'paths.Path':
+        if self._pool is not None:
+            self._path = self._pool.acquire()
+            return self._path
+
+        from utils3.system import paths
 
-    def __enter__(self) -> paths.Path:
         os.mkdir(self._container)
         pth = paths.Path(self._container)
         self._cwd = os.getcwd()
@@ -303,6 +544,12 @@ class Container:
         return pth
 
     def __exit__(self, *args):
+        if self._pool is not None:
+            self._pool.release(self._path)
+            return
+
+        import shutil
+
         os.chdir(self._cwd)
         shutil.rmtree(self._container)
 
@@ -380,23 +627,117 @@ class Suppressor:
 
 
 class BinaryDecompression:
-    def __init__(self, binary: str):
-        self._tempFile = tempfile.NamedTemporaryFile(delete=True)
-        base64DecodeFile(file_path=self._tempFile.name, data=binary)
-        self._mod()
+    """
+    Write an embedded base64 encoded executable to disk and make it executable, `binary` is its path.
 
-    def _mod(self):
-        subprocess.check_call([
-            'chmod',
-            '+x',
-            self._tempFile.name
-        ])
+    :param binary: The base64 encoded executable, e.g. from base64File
+    :param compression: 'zlib' or 'lzma' when the executable was compressed before it was encoded
+    :param cache: Extract into a directory keyed by the payload's hash and reuse that file on later runs instead of
+        a temporary file deleted with this object. True uses ~/.cache/utils3/binaries, a path picks the directory.
+    """
 
+    def __init__(self, binary: str, compression: str = None, cache=False):
+        assert compression in (None, 'zlib', 'lzma'), 'Unknown compression {}'.format(compression)
+        self._binary = binary
+        self._compression = compression
+        self._tempFile = None
+        self._path = None
+
+        if cache:
+            self._path = self._cached(_BINARY_CACHE if cache is True else os.fspath(cache))
+        else:
+            import tempfile
+
+            self._tempFile = tempfile.NamedTemporaryFile(delete=True)
+            _writeChunks(self._chunks(), self._tempFile.name)
+            self._mod(self._tempFile.name)
+        # Only needed while extracting
+        del self._binary
+
+    def _payload(self, size: int = _BASE64_CHUNK):
+        for start in range(0, len(self._binary), size):
+            yield self._binary[start:start + size]
+
+    def _chunks(self):
+        """The decoded and decompressed executable, chunk by chunk"""
+        chunks = iterBase64Decode(self._payload())
+        if self._compression is None:
+            yield from chunks
+            return
+        if self._compression == 'zlib':
+            import zlib
+
+            decompressor = zlib.decompressobj()
+        else:
+            import lzma
+
+            decompressor = lzma.LZMADecompressor()
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+        if not decompressor.eof:
+            raise ValueError('The {} compressed binary is truncated'.format(self._compression))
+
+    def _expectedSize(self):
+        """The decoded size of an uncompressed payload, without decoding it"""
+        if self._compression is not None:
+            return None
+        data = self._binary
+        if isinstance(data, str):
+            whitespace, padding = (' ', '\t', '\r', '\n'), '='
+        else:
+            whitespace, padding = (b' ', b'\t', b'\r', b'\n'), b'='
+        length = len(data) - sum(data.count(c) for c in whitespace)
+        tail = data[-8:].rstrip()
+        return length * 3 // 4 - (len(tail) - len(tail.rstrip(padding)))
+
+    def _cached(self, cache_dir: str) -> str:
+        import hashlib
+
+        digest = hashlib.sha256()
+        for chunk in self._payload():
+            digest.update(chunk.encode('ascii') if isinstance(chunk, str) else chunk)
+        digest.update(str(self._compression).encode())
+        path = os.path.join(cache_dir, digest.hexdigest())
+
+        # Files only appear under their final name complete, so existing, executable and sized right is enough
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            pass
+        else:
+            import stat as stat_module
+
+            expected = self._expectedSize()
+            if (stat_module.S_ISREG(stat.st_mode) and stat.st_mode & stat_module.S_IXUSR and
+                    (expected is None or stat.st_size == expected)):
+                return path
 
+        import tempfile
+
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.extract-')
+        try:
+            with open(fd, 'wb') as f:
+                _writeChunks(self._chunks(), f)
+            self._mod(temp_path)
+            # Atomic, processes extracting the same payload at once all end up with a complete file
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return path
+
+    @staticmethod
+    def _mod(path: str):
+        # Like chmod +x
+        os.chmod(path, os.stat(path).st_mode | 0o111)
 
     @property
     def binary(self):
-        assert self._tempFile.name is not None, 'Binary not found.'
-        return self._tempFile.name
+        assert self._path is not None or self._tempFile.name is not None, 'Binary not found.'
+        return self._path if self._path is not None else self._tempFile.name
 
 
@@ -0,0 +1,50 @@
+"""Cheap caller attribution built on sys._getframe instead of inspect.stack()"""
+import sys
+import functools
+import collections
+
+
+def codeInfo(code) -> (str, str):
+    """The file and function name of a code object"""
+    return code.co_filename, code.co_name
+
+
+class CallSiteCounter:
+    """Count the (file, function, line) call sites a function is called from.
+    Use as a decorator, or call hit() from inside the function to attribute.
+    Increments aren't locked, counts may be slightly low when several threads hit the same site at once.
+    Sites are kept by name, not by code object, so counting doesn't keep generated code alive."""
+
+    def __init__(self):
+        self._counts = collections.Counter()
+
+    def __call__(self, func):
+        counts = self._counts
+        getframe = sys._getframe
+
+        @functools.wraps(func)
+        def counted_wrapper(*args, **kwargs):
+            frame = getframe(1)
+            code = frame.f_code
+            counts[(code.co_filename, code.co_name, frame.f_lineno)] += 1
+            return func(*args, **kwargs)
+
+        return counted_wrapper
+
+    def hit(self, depth: int = 1):
+        """Count the call site of the function calling hit(). Raise depth to attribute further up the stack."""
+        frame = sys._getframe(depth + 1)
+        code = frame.f_code
+        self._counts[(code.co_filename, code.co_name, frame.f_lineno)] += 1
+
+    def counts(self) -> {(str, str, int): int}:
+        """The hit count of every call site, keyed by (file, function, line)"""
+        return dict(self._counts)
+
+    def top(self, n: int = 10) -> [((str, str, int), int)]:
+        """The n call sites with the most hits"""
+        return collections.Counter(self.counts()).most_common(n)
+
+    def reset(self):
+        """Forget every hit"""
+        self._counts.clear()
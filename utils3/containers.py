@@ -0,0 +1,121 @@
+"""Pooled scratch directories for Container.
+
+A ContainerPool keeps directories pre-created below one root, on tmpfs (/dev/shm) when it is
+available, and hands them out as paths: the working directory of the process isn't touched,
+so threads can each use their own container. A returned directory is renamed out of the way
+and deleted by a background thread, which also tops the pool back up."""
+import os
+import queue
+import atexit
+import shutil
+import tempfile
+import itertools
+import threading
+import collections
+
+# Preferred root for pools, memory backed on Linux
+_TMPFS = "/dev/shm"
+
+
+def _defaultRoot() -> str:
+    if os.path.isdir(_TMPFS) and os.access(_TMPFS, os.W_OK | os.X_OK):
+        return _TMPFS
+    return tempfile.gettempdir()
+
+
+class ContainerPool:
+    """
+    Hands out empty scratch directories without changing the working directory and deletes them in the background.
+
+    :param size: The number of empty directories kept ready
+    :param root: The directory to create the pool in, defaults to /dev/shm when writable, else the temp directory
+    :param prefix: Prefix of the pool's directory name
+    """
+
+    def __init__(self, size: int = 8, root: str = None, prefix: str = "utils3-containers-"):
+        assert size >= 0, "size can't be negative"
+        self.size = size
+        # Absolute, handed out paths stay valid when the working directory changes and release() can compare them
+        root = root if root is not None else _defaultRoot()
+        self.root = os.path.abspath(tempfile.mkdtemp(prefix=prefix, dir=root))
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+        self._free = collections.deque()
+        self._removals = queue.SimpleQueue()
+        self._closed = False
+
+        for _ in range(size):
+            self._free.append(self._create())
+        threading.Thread(target=self._cleanup, daemon=True, name="utils3-containers").start()
+        atexit.register(self.close)
+
+    def _create(self) -> str:
+        directory = os.path.join(self.root, str(next(self._names)))
+        os.mkdir(directory)
+        return directory
+
+    def acquire(self) -> 'paths.Path':
+        """An empty directory, give it back with release()"""
+        from utils3.system import paths
+
+        assert not self._closed, "The pool is closed"
+        with self._lock:
+            directory = self._free.popleft() if self._free else None
+        if directory is None:
+            # The pool ran dry, create one on the caller's thread
+            directory = self._create()
+        return paths.Path(directory)
+
+    def release(self, directory):
+        """Return a directory from acquire(), it is deleted on the background thread"""
+        directory = getattr(directory, "path", directory)
+        assert os.path.dirname(os.path.abspath(directory)) == self.root, "{} isn't from this pool".format(directory)
+        # A rename is cheap, the slow rmtree happens on the background thread
+        trash = os.path.join(self.root, ".trash-{}".format(next(self._names)))
+        os.rename(directory, trash)
+        self._removals.put(trash)
+
+    def _cleanup(self):
+        while True:
+            trash = self._removals.get()
+            if trash is None:
+                return
+            shutil.rmtree(trash, ignore_errors=True)
+            # Top the pool back up after each removal, acquire() only creates directories when it's empty
+            with self._lock:
+                missing = not self._closed and len(self._free) < self.size
+            if missing:
+                try:
+                    directory = self._create()
+                except OSError:
+                    continue
+                with self._lock:
+                    self._free.append(directory)
+
+    def close(self):
+        """Delete the pool with every directory in it, including ones that weren't released"""
+        if self._closed:
+            return
+        self._closed = True
+        self._removals.put(None)
+        atexit.unregister(self.close)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def defaultPool() -> ContainerPool:
+    """The pool shared by Container(pool=True), created on first use"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ContainerPool()
+        return _default_pool
@@ -0,0 +1,221 @@
+"""Shared executors behind runAsThread and runInProcess.
+
+Threads come from a pool of daemon threads: idle threads are reused instead of starting a new
+thread per call, a new thread is only started when none is idle, and threads that stay idle
+for idle_timeout seconds exit. Like the threads runAsThread used to start, they don't keep the
+interpreter alive, so long running loops are fine. CPU bound work goes to a process pool."""
+import queue
+import importlib
+import functools
+import threading
+import concurrent.futures
+
+
+class ThreadFuture(concurrent.futures.Future):
+    """A Future that also answers the threading.Thread calls older runAsThread callers make.
+    An exception nobody retrieved with result() or exception() is reported through threading.excepthook when the
+    future is garbage collected, like the exception of a plain thread was."""
+
+    _retrieved = False
+    _worker = None
+
+    def join(self, timeout: float = None):
+        """Wait for the call to finish, like Thread.join it doesn't raise the call's exception"""
+        concurrent.futures.wait([self], timeout=timeout)
+
+    def is_alive(self) -> bool:
+        return not self.done()
+
+    def result(self, timeout: float = None):
+        self._retrieved = True
+        return super().result(timeout)
+
+    def exception(self, timeout: float = None):
+        self._retrieved = True
+        return super().exception(timeout)
+
+    def __del__(self):
+        error = self._exception
+        if error is None or self._retrieved:
+            return
+        try:
+            threading.excepthook(threading.ExceptHookArgs((type(error), error, error.__traceback__, self._worker)))
+        except Exception:
+            # The interpreter may be shutting down
+            pass
+
+
+class _DaemonThreadPool:
+    def __init__(self, max_workers: int = None, idle_timeout: float = 60.0):
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        # Workers waiting in queue.get() and queued calls no worker has taken yet, a new thread is only started
+        # when the queued calls outnumber the waiting workers
+        self._idle = 0
+        self._pending = 0
+
+    def submit(self, func, args, kwargs, future: ThreadFuture):
+        with self._lock:
+            self._queue.put((future, func, args, kwargs))
+            self._pending += 1
+            if self._pending <= self._idle:
+                return
+            if self.max_workers is not None and self._workers >= self.max_workers:
+                # Picked up by the next worker that finishes
+                return
+            self._workers += 1
+        threading.Thread(target=self._work, daemon=True, name="utils3-worker").start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            try:
+                future, func, args, kwargs = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._idle -= 1
+                    if self._pending == 0:
+                        self._workers -= 1
+                        return
+                # A call was queued just as the wait timed out, take it
+                continue
+            with self._lock:
+                self._idle -= 1
+                self._pending -= 1
+
+            if future.set_running_or_notify_cancel():
+                future._worker = threading.current_thread()
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            del future, func, args, kwargs
+
+
+_lock = threading.Lock()
+_thread_pool = _DaemonThreadPool()
+_process_pool = None
+_process_workers = None
+_in_flight = None
+
+
+def configureExecutor(max_workers: int = None, max_in_flight: int = None, idle_timeout: float = 60.0,
+                      process_workers: int = None):
+    """
+    Configure the shared executors, calls already submitted are not affected.
+
+    :param max_workers: The maximum number of pool threads, None to start a thread whenever none is idle. Keep it
+        None (or large) when runAsThread starts long running loops, they occupy a thread each.
+    :param max_in_flight: Block submitting when this many calls (threads and processes) haven't finished yet
+    :param idle_timeout: Seconds an idle pool thread waits for work before it exits
+    :param process_workers: The size of the process pool, defaults to the number of CPUs
+    """
+    global _thread_pool, _process_pool, _process_workers, _in_flight
+    with _lock:
+        _thread_pool = _DaemonThreadPool(max_workers, idle_timeout)
+        _in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        if process_workers != _process_workers and _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+        _process_workers = process_workers
+
+
+def _bounded(submit):
+    """Run submit() under the in flight bound, the slot is released when the returned future is done"""
+    in_flight = _in_flight
+    if in_flight is None:
+        return submit()
+    in_flight.acquire()
+    try:
+        future = submit()
+    except BaseException:
+        in_flight.release()
+        raise
+    future.add_done_callback(lambda _: in_flight.release())
+    return future
+
+
+def submitThread(func, *args, **kwargs) -> ThreadFuture:
+    """Run a call on the shared thread pool"""
+    def submit():
+        future = ThreadFuture()
+        _thread_pool.submit(func, args, kwargs, future)
+        return future
+
+    return _bounded(submit)
+
+
+def processExecutor() -> concurrent.futures.ProcessPoolExecutor:
+    """The shared process pool, started on first use"""
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=_process_workers)
+        return _process_pool
+
+
+def _call_by_name(module: str, qualname: str, *args, **kwargs):
+    """Call a function decorated with runInProcess inside a worker process.
+    The decorated name refers to the wrapper, so the function itself can't be pickled by reference."""
+    target = importlib.import_module(module)
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    if getattr(target, "__utils3_process__", False):
+        target = target.__wrapped__
+    return target(*args, **kwargs)
+
+
+def _picklable(func):
+    if getattr(func, "__utils3_process__", False):
+        return functools.partial(_call_by_name, func.__module__, func.__qualname__)
+    return func
+
+
+def submitProcess(func, *args, **kwargs) -> concurrent.futures.Future:
+    """Run a call on the shared process pool. The function, arguments and result must be picklable."""
+    target = _picklable(func)
+    return _bounded(lambda: processExecutor().submit(target, *args, **kwargs))
+
+
+def _run_chunk(func, chunk):
+    return [func(*args) for args in chunk]
+
+
+def _chunks(iterables, chunksize):
+    chunk = []
+    for args in zip(*iterables):
+        chunk.append(args)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def threadMap(func, *iterables, chunksize: int = 1, timeout: float = None):
+    """Like map() with the calls spread over the thread pool, chunksize calls per task. Results are yielded in
+    order, the first exception is raised when its result is reached."""
+    futures = [submitThread(_run_chunk, func, chunk) for chunk in _chunks(iterables, chunksize)]
+    return _results(futures, timeout)
+
+
+def processMap(func, *iterables, chunksize: int = 1, timeout: float = None):
+    """Like map() with the calls spread over the process pool, chunksize calls are sent to a process at once"""
+    target = _picklable(func)
+    futures = [submitProcess(_run_chunk, target, chunk) for chunk in _chunks(iterables, chunksize)]
+    return _results(futures, timeout)
+
+
+def _results(futures, timeout):
+    try:
+        for future in futures:
+            yield from future.result(timeout=timeout)
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,300 @@
+"""Latency oriented fallbacks: hedged calls, retries with jittered backoff and a circuit breaker.
+
+A hedged call starts the primary function and, when it hasn't finished within the hedge delay,
+starts the fallback as well. The first successful result is returned. A losing fallback is
+cancelled (asyncio) or cancelled when it hasn't started yet (threads), a losing primary runs
+to the end in the background so its latency and outcome still reach the learned delay and the
+circuit breaker, its result is ignored. Calls run on daemon threads that are started when none
+is idle, so neither call ever queues behind primaries that hang; the number of those is capped
+per decorated function, beyond it calls go straight to the fallback."""
+import time
+import random
+import asyncio
+import functools
+import threading
+import collections
+import concurrent.futures
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _submit(func, *args, **kwargs) -> concurrent.futures.Future:
+    """Run a call on the hedging pool, it has no worker limit so nothing waits behind hung calls"""
+    global _pool
+    from utils3.executors import ThreadFuture, _DaemonThreadPool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = _DaemonThreadPool()
+    future = ThreadFuture()
+    _pool.submit(func, args, kwargs, future)
+    return future
+
+
+def _retrieve(future):
+    if not future.cancelled():
+        # A failing loser isn't reported as an unhandled error
+        future.exception()
+
+
+class _Abandoned:
+    """Losing primaries still running in the background"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def full(self) -> bool:
+        return self.limit is not None and self.count >= self.limit
+
+    def add(self, future):
+        with self._lock:
+            self.count += 1
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self.count -= 1
+        _retrieve(future)
+
+
+class CircuitBreaker:
+    """Skip a primary that keeps failing. After failure_threshold consecutive failures the circuit opens and
+    calls go straight to the fallback. After reset_timeout seconds one call is let through to probe the
+    primary, its outcome closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half-open'"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        """Should the primary be called"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class _LatencyTracker:
+    """Recent latencies of successful primary calls, to learn the hedge delay from"""
+
+    def __init__(self, percentile: float, window: int = 200, minimum_samples: int = 20):
+        self.percentile = percentile
+        self.minimum_samples = minimum_samples
+        self._samples = collections.deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def delay(self):
+        """The learned delay, None until enough calls were seen"""
+        samples = sorted(self._samples)
+        if len(samples) < self.minimum_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.percentile / 100))]
+
+
+def _backoff(attempt: int, backoff: float, max_backoff: float) -> float:
+    # "Full jitter": a random wait up to the exponential backoff, retries of many callers don't line up
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def hedge(redundancy_function: callable, hedge_delay=None, retries: int = 0, backoff: float = 0.1,
+          max_backoff: float = 2.0, breaker: CircuitBreaker = None, percentile: float = 95,
+          max_abandoned: int = 8):
+    """
+    Decorator calling redundancy_function when the wrapped function fails or is slow. Coroutine functions get
+    an asyncio implementation, everything else runs the calls on a shared thread pool.
+
+    :param redundancy_function: The fallback, called with the same arguments
+    :param hedge_delay: Seconds to wait for the primary before also starting the fallback. "auto" learns the
+        delay from the given percentile of recent primary latencies (no hedging until 20 calls were seen).
+        None only falls back when the primary fails.
+    :param retries: Retries of the primary before it counts as failed
+    :param backoff: Base of the exponential backoff between retries, in seconds, the wait is jittered
+    :param max_backoff: Upper bound of a single backoff wait
+    :param breaker: A CircuitBreaker, while it's open the primary is skipped
+    :param percentile: The latency percentile used by hedge_delay="auto"
+    :param max_abandoned: Losing primaries allowed to still run in the background, while there are this many calls
+        skip the primary and only run the fallback. None for no limit.
+    """
+    tracker = _LatencyTracker(percentile) if hedge_delay == "auto" else None
+
+    def delay():
+        return tracker.delay() if tracker is not None else hedge_delay
+
+    def record(elapsed, failed):
+        if breaker is not None:
+            if failed:
+                breaker.failure()
+            else:
+                breaker.success()
+        if tracker is not None and not failed:
+            tracker.add(elapsed)
+
+    def decorator(function):
+        abandoned = _Abandoned(max_abandoned)
+        if asyncio.iscoroutinefunction(function):
+            return _hedge_async(function, redundancy_function, delay, record, retries, backoff, max_backoff, breaker,
+                                abandoned)
+        return _hedge_threads(function, redundancy_function, delay, record, retries, backoff, max_backoff, breaker,
+                              abandoned)
+
+    return decorator
+
+
+def _hedge_threads(function, fallback, delay, record, retries, backoff, max_backoff, breaker, abandoned):
+    def primary(*args, **kwargs):
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                if attempt == retries:
+                    record(time.perf_counter() - start, True)
+                    raise
+                time.sleep(_backoff(attempt, backoff, max_backoff))
+            else:
+                record(time.perf_counter() - start, False)
+                return result
+
+    @functools.wraps(function)
+    def hedge_wrapper(*args, **kwargs):
+        if abandoned.full() or (breaker is not None and not breaker.allow()):
+            return fallback(*args, **kwargs)
+
+        wait = delay()
+        if wait is None:
+            try:
+                return primary(*args, **kwargs)
+            except Exception:
+                return fallback(*args, **kwargs)
+
+        first = _submit(primary, *args, **kwargs)
+        try:
+            return first.result(timeout=wait)
+        except concurrent.futures.TimeoutError:
+            pass
+        except Exception:
+            return fallback(*args, **kwargs)
+
+        second = _submit(fallback, *args, **kwargs)
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+            # Both failed, surface the fallback's error like the plain redundancy decorator does
+            return second.result()
+        finally:
+            if not second.cancel():
+                second.add_done_callback(_retrieve)
+            if first in pending:
+                abandoned.add(first)
+
+    return hedge_wrapper
+
+
+# Primaries that lost the race, referenced until they finish
+_background = set()
+
+
+def _forget(task):
+    _background.discard(task)
+    if not task.cancelled():
+        task.exception()
+
+
+def _hedge_async(function, fallback, delay, record, retries, backoff, max_backoff, breaker, abandoned):
+    if not asyncio.iscoroutinefunction(fallback):
+        sync_fallback = fallback
+
+        async def fallback(*args, **kwargs):
+            return await asyncio.to_thread(sync_fallback, *args, **kwargs)
+
+    async def primary(*args, **kwargs):
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                result = await function(*args, **kwargs)
+            except Exception:
+                if attempt == retries:
+                    record(time.perf_counter() - start, True)
+                    raise
+                await asyncio.sleep(_backoff(attempt, backoff, max_backoff))
+            else:
+                record(time.perf_counter() - start, False)
+                return result
+
+    @functools.wraps(function)
+    async def hedge_wrapper(*args, **kwargs):
+        if abandoned.full() or (breaker is not None and not breaker.allow()):
+            return await fallback(*args, **kwargs)
+
+        wait = delay()
+        if wait is None:
+            try:
+                return await primary(*args, **kwargs)
+            except Exception:
+                return await fallback(*args, **kwargs)
+
+        first = asyncio.ensure_future(primary(*args, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=wait)
+        if done:
+            if first.exception() is None:
+                return first.result()
+            return await fallback(*args, **kwargs)
+
+        second = asyncio.ensure_future(fallback(*args, **kwargs))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            return second.result()
+        finally:
+            if second in pending:
+                second.cancel()
+            if first in pending:
+                # A slow primary runs to the end, its latency and outcome feed the learned delay and the breaker
+                _background.add(first)
+                first.add_done_callback(_forget)
+                abandoned.add(first)
+
+    return hedge_wrapper
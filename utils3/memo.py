@@ -0,0 +1,293 @@
+"""Memoisation decorators with LRU/TTL eviction, single-flight misses and statistics"""
+import os
+import sys
+import time
+import pickle
+import asyncio
+import hashlib
+import functools
+import threading
+import collections
+
+class _KwargsMark:
+    """Separates positional from keyword arguments in cache keys. A class pickles by reference, so persisted keys
+    compare equal after loading, object() wouldn't."""
+
+
+_KWARGS_MARK = _KwargsMark
+
+
+def _make_key(args, kwargs, typed: bool):
+    key = args
+    items = ()
+    if kwargs:
+        items = tuple(sorted(kwargs.items()))
+        key += (_KWARGS_MARK,) + items
+    if typed:
+        # In the sorted order of the keyword arguments, not the order they were passed in
+        key += tuple(type(arg) for arg in args) + tuple(type(value) for _, value in items)
+    return key
+
+
+class _InFlight:
+    """A computation other callers with the same key wait for"""
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _Cache:
+    """An LRU cache bounded by entry count and/or approximate bytes, with optional expiry"""
+
+    def __init__(self, maxsize, maxbytes, ttl, sizeof, persist):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.inflight = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+        if persist is not None:
+            os.makedirs(persist, exist_ok=True)
+
+    # In memory, call with the lock held
+    def get(self, key):
+        """(True, value) on a hit, (False, None) on a miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        value, expires, size = entry
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return False, None
+        self.entries.move_to_end(key)
+        return True, value
+
+    def put(self, key, value, expires=None):
+        if key in self.entries:
+            self._remove(key)
+        if expires is None and self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        self.entries[key] = (value, expires, size)
+        self.bytes += size
+
+        while self.entries and ((self.maxsize is not None and len(self.entries) > self.maxsize) or
+                                (self.maxbytes is not None and self.bytes > self.maxbytes)):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    # On disk, safe to call without the lock
+    def _disk_path(self, key):
+        try:
+            digest = hashlib.sha256(pickle.dumps(key)).hexdigest()
+        except Exception:
+            # Keys that can't be pickled are only cached in memory
+            return None
+        return os.path.join(self.persist, digest + ".pkl")
+
+    def load(self, key):
+        """(True, value, expires) when the key was persisted and hasn't expired"""
+        if self.persist is None:
+            return False, None, None
+        file_path = self._disk_path(key)
+        if file_path is None:
+            return False, None, None
+        try:
+            with open(file_path, "rb") as f:
+                stored_key, value, expires_at = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None, None
+        if stored_key != key:
+            return False, None, None
+        if expires_at is not None and expires_at <= time.time():
+            return False, None, None
+        # Disk entries expire on the wall clock, memory entries on the monotonic clock
+        expires = None if expires_at is None else time.monotonic() + expires_at - time.time()
+        return True, value, expires
+
+    def save(self, key, value):
+        if self.persist is None:
+            return
+        file_path = self._disk_path(key)
+        if file_path is None:
+            return
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        temp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump((key, value, expires_at), f)
+            os.replace(temp_path, file_path)
+        except Exception:
+            # Values that can't be pickled are only cached in memory
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def info(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self.entries),
+                "bytes": self.bytes,
+                "maxsize": self.maxsize,
+                "maxbytes": self.maxbytes,
+                "ttl": self.ttl,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+def _memoize_sync(func, cache: _Cache, typed: bool):
+    @functools.wraps(func)
+    def memoize_wrapper(*args, **kwargs):
+        key = _make_key(args, kwargs, typed)
+        with cache.lock:
+            found, value = cache.get(key)
+            if found:
+                cache.hits += 1
+                return value
+            call = cache.inflight.get(key)
+            owner = call is None
+            if owner:
+                call = cache.inflight[key] = _InFlight()
+
+        if not owner:
+            # Somebody is already computing this key, share their result
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            with cache.lock:
+                cache.hits += 1
+            return call.value
+
+        try:
+            found, value, expires = cache.load(key)
+            if not found:
+                value = func(*args, **kwargs)
+                cache.save(key, value)
+            call.value = value
+            with cache.lock:
+                if found:
+                    cache.disk_hits += 1
+                else:
+                    cache.misses += 1
+                cache.put(key, value, expires)
+            return value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with cache.lock:
+                del cache.inflight[key]
+            call.event.set()
+
+    return memoize_wrapper
+
+
+def _memoize_async(func, cache: _Cache, typed: bool):
+    @functools.wraps(func)
+    async def memoize_wrapper(*args, **kwargs):
+        key = _make_key(args, kwargs, typed)
+        with cache.lock:
+            found, value = cache.get(key)
+            if found:
+                cache.hits += 1
+                return value
+            future = cache.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = cache.inflight[key] = asyncio.get_running_loop().create_future()
+
+        if not owner:
+            # shield() keeps a cancelled waiter from cancelling the shared computation
+            value = await asyncio.shield(future)
+            with cache.lock:
+                cache.hits += 1
+            return value
+
+        try:
+            found, value, expires = cache.load(key)
+            if not found:
+                value = await func(*args, **kwargs)
+                cache.save(key, value)
+            with cache.lock:
+                if found:
+                    cache.disk_hits += 1
+                else:
+                    cache.misses += 1
+                cache.put(key, value, expires)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting for it
+            future.exception()
+            raise
+        finally:
+            with cache.lock:
+                del cache.inflight[key]
+
+    return memoize_wrapper
+
+
+def memoize(maxsize: int = 128, maxbytes: int = None, ttl: float = None, persist: str = None,
+            typed: bool = False, sizeof: callable = sys.getsizeof):
+    """
+    Cache the results of a function, coroutine functions get an async variant.
+    Concurrent misses on the same key compute once, the other callers wait for that result (or exception).
+
+    :param maxsize: The maximum number of cached results, None for no limit
+    :param maxbytes: The maximum approximate size of the cached results in bytes, as measured by sizeof
+    :param ttl: Seconds before a cached result expires, None to never expire
+    :param persist: A directory to also store results in, so they survive restarts. Arguments and results
+        must be picklable, anything else is only cached in memory.
+    :param typed: Cache arguments of different types separately, e.g. 1 and 1.0
+    :param sizeof: Measures a result for maxbytes, sys.getsizeof doesn't include the contents of containers
+    :return: A decorator. The decorated function has cache_info() returning hit/miss/eviction statistics and
+        cache_clear().
+    """
+    if callable(maxsize):
+        # Used as @memoize without arguments
+        return memoize()(maxsize)
+
+    def memoizeDecorator(func):
+        cache_dir = None
+        if persist is not None:
+            cache_dir = os.path.join(persist, "{}.{}".format(func.__module__, func.__qualname__))
+        cache = _Cache(maxsize, maxbytes, ttl, sizeof, cache_dir)
+
+        if asyncio.iscoroutinefunction(func):
+            wrapper = _memoize_async(func, cache, typed)
+        else:
+            wrapper = _memoize_sync(func, cache, typed)
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return memoizeDecorator
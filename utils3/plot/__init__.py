@@ -1,16 +1,80 @@
 import os
 import time
+import atexit
+import weakref
+import threading
 from pathlib import Path
+from utils3.plot.downsample import MinMaxDownsampler, LTTBDownsampler
+from utils3.plot.ring import RingPlotWriter, RingPlotReader
 DISABLED_PLOT = False
 
+# Buffered writers that are still open, flushed when the interpreter exits
+_open_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_writers():
+    for writer in list(_open_writers):
+        writer.close()
+
+
+def _flush_periodically(writer_ref, stop: threading.Event, interval: float):
+    # Only a weak reference is held so an abandoned writer can still be collected
+    while not stop.wait(interval):
+        writer = writer_ref()
+        if writer is None:
+            return
+        writer.flush()
+        del writer
+
+
+def _as_list(values) -> list:
+    # tolist() turns NumPy arrays into Python scalars in a single C call
+    if hasattr(values, "tolist"):
+        return values.tolist()
+    return list(values)
+
+
+def _format_points(xs: list, ys: list) -> str:
+    """Format x,y pairs exactly like write_xy does, in a single formatting pass."""
+    flat = [None] * (2 * len(xs))
+    flat[0::2] = xs
+    flat[1::2] = ys
+    return ("%s,%s\n" * len(xs)) % tuple(flat)
+
 
 class PrimitivePlotWriter:
     """Base class for plot writers that handles file operations and primitive x,y writing."""
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, buffered: bool = False, max_points: int = 4096, flush_interval: float = 0.1):
+        """
+        :param file_path: The plot file to write to
+        :param buffered: Keep the file open and batch points in memory instead of opening the file for every point.
+            Batches are written when max_points is reached, every flush_interval seconds from a background thread,
+            on flush()/close() and when leaving a 'with' block.
+        :param max_points: The number of buffered points that triggers a write
+        :param flush_interval: The maximum time in seconds a point stays in the buffer
+        """
+        assert max_points > 0, "max_points must be positive"
+        assert flush_interval is not None and flush_interval > 0, "flush_interval must be positive"
         self.file_path = Path(file_path)
+        self.buffered = buffered
+        self.max_points = max_points
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._pending = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
         self._ensure_file_exists()
 
+        if self.buffered:
+            self._file = open(self.file_path, "a")
+            _open_writers.add(self)
+            threading.Thread(target=_flush_periodically,
+                             args=(weakref.ref(self), self._stop, self.flush_interval),
+                             daemon=True).start()
+
     def _ensure_file_exists(self):
         """Create the file if it doesn't exist."""
         self.file_path.parent.mkdir(parents=True, exist_ok=True)
@@ -20,35 +84,125 @@ class PrimitivePlotWriter:
     def write_xy(self, x: float, y: float):
         """Write an x,y coordinate pair."""
         if not DISABLED_PLOT:
+            self._write(f"{x},{y}\n", 1)
+
+    def write_xy_many(self, xs, ys):
+        """Write many x,y coordinate pairs at once. Accepts lists, iterables or NumPy arrays."""
+        if DISABLED_PLOT:
+            return
+        xs = _as_list(xs)
+        ys = _as_list(ys)
+        assert len(xs) == len(ys), "xs and ys must have the same length"
+        if xs:
+            self._write(_format_points(xs, ys), len(xs))
+
+    def _write(self, text: str, points: int):
+        """Write already formatted lines, through the buffer when buffered."""
+        if not self.buffered:
             with open(self.file_path, "a") as file:
-                file.write(f"{x},{y}\n")
+                file.write(text)
                 file.flush()
+            return
+
+        with self._lock:
+            assert self._file is not None, "Plot writer has been closed"
+            self._buffer.append(text)
+            self._pending += points
+            if self._pending >= self.max_points:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer and self._file is not None:
+            self._file.write("".join(self._buffer))
+            self._file.flush()
+        self._buffer.clear()
+        self._pending = 0
+
+    def flush(self):
+        """Write any buffered points to the file."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Flush buffered points and close the file."""
+        self._stop.set()
+        with self._lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        _open_writers.discard(self)
 
     def reset(self):
         """Clear file."""
-        with open(self.file_path, "w") as file:
-            file.write("clear\n")
+        with self._lock:
+            # Points buffered before the reset belong to the cleared plot, so they are dropped
+            self._buffer.clear()
+            self._pending = 0
+            with open(self.file_path, "w") as file:
+                file.write("clear\n")
+            if self._file is not None:
+                self._file.close()
+                self._file = open(self.file_path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class SimplePlotWriter(PrimitivePlotWriter):
     """Simple API to write y values with auto-incrementing x."""
 
-    def __init__(self, file_path: str = None):
+    def __init__(self, file_path: str = None, downsampler=None, **kwargs):
+        """
+        :param file_path: The plot file to write to, defaults to the plotview container
+        :param downsampler: An optional MinMaxDownsampler or LTTBDownsampler, x keeps counting every input value
+            but only the points kept by the downsampler are written
+        :param kwargs: Buffering options, see PrimitivePlotWriter
+        """
         if file_path is None:
             file_path = "{}/Library/Containers/SVO-Productions.plotview/Data/tmp/plot.plt".format(os.path.expanduser("~"))
-        super().__init__(file_path)
         self.x = 0
+        self.downsampler = downsampler
+        super().__init__(file_path, **kwargs)
 
     def write(self, y: float):
         """Write a y value. X automatically increments."""
         if not DISABLED_PLOT:
-            self.write_xy(self.x, y)
+            if self.downsampler is None:
+                self.write_xy(self.x, y)
+            else:
+                for point in self.downsampler.push(self.x, y):
+                    self.write_xy(*point)
             self.x += 1
 
+    def write_many(self, ys):
+        """Write many y values at once. X automatically increments for every value."""
+        if DISABLED_PLOT:
+            return
+        ys = _as_list(ys)
+        xs = list(range(self.x, self.x + len(ys)))
+        self.x += len(ys)
+        if self.downsampler is not None:
+            xs, ys = self.downsampler.push_many(xs, ys)
+        self.write_xy_many(xs, ys)
+
+    def close(self):
+        """Write the points held back by the downsampler, then flush and close the file."""
+        if self.downsampler is not None and not DISABLED_PLOT:
+            points = self.downsampler.flush()
+            if points:
+                self.write_xy_many([p[0] for p in points], [p[1] for p in points])
+        super().close()
+
     def reset(self):
         """Clear file and reset x to 0."""
         super().reset()
         self.x = 0
+        if self.downsampler is not None:
+            self.downsampler.reset()
 
 
 # # Example usage
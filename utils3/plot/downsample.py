@@ -0,0 +1,130 @@
+"""Streaming downsamplers that reduce high-rate signals before they are written to a plot file"""
+
+
+class _Downsampler:
+    """Base class for downsamplers. Points go in through push/push_many, the kept points come out."""
+
+    def __init__(self, bucket_size: int):
+        """
+        :param bucket_size: The number of input points that are reduced to a single bucket
+        """
+        assert bucket_size >= 2, "bucket_size must be at least 2"
+        self.bucket_size = bucket_size
+        self._pending = []
+
+    def push(self, x: float, y: float) -> [(float, float)]:
+        """Add a point, returns the points that are ready to be written (usually none)"""
+        self._pending.append((x, y))
+        return self._drain()
+
+    def push_many(self, xs, ys) -> ([float], [float]):
+        """Add a batch of points, returns the x and y values that are ready to be written"""
+        self._pending.extend(zip(xs, ys))
+        out = self._drain()
+        return [p[0] for p in out], [p[1] for p in out]
+
+    def flush(self) -> [(float, float)]:
+        """End of the stream, returns whatever is still held back"""
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget all held back points"""
+        self._pending = []
+
+    def _drain(self) -> [(float, float)]:
+        raise NotImplementedError
+
+
+class MinMaxDownsampler(_Downsampler):
+    """Keep the minimum and maximum of every bucket, in the order they occurred.
+    Peaks are never lost, the output rate is 2 / bucket_size of the input rate."""
+
+    def _drain(self):
+        out = []
+        size = self.bucket_size
+        pending = self._pending
+        start = 0
+        while len(pending) - start >= size:
+            out.extend(self._bucket(pending[start:start + size]))
+            start += size
+
+        if start:
+            del pending[:start]
+        return out
+
+    @staticmethod
+    def _bucket(bucket):
+        low = min(bucket, key=lambda p: p[1])
+        high = max(bucket, key=lambda p: p[1])
+        if low is high:
+            return [low]
+        return [low, high] if low[0] <= high[0] else [high, low]
+
+    def flush(self):
+        out = self._bucket(self._pending) if self._pending else []
+        self._pending = []
+        return out
+
+
+class LTTBDownsampler(_Downsampler):
+    """Largest-Triangle-Three-Buckets downsampling, one point is kept per bucket.
+    The streaming variant holds back up to two buckets: a bucket is only reduced once the
+    following bucket is complete, as its average is the third corner of the triangle."""
+
+    def __init__(self, bucket_size: int):
+        super().__init__(bucket_size)
+        self._anchor = None
+
+    def _select(self, bucket, following):
+        ax, ay = self._anchor
+        cx = sum(p[0] for p in following) / len(following)
+        cy = sum(p[1] for p in following) / len(following)
+        best = None
+        best_area = -1.0
+        for point in bucket:
+            # Twice the triangle area, the factor doesn't change which point wins
+            area = abs((ax - cx) * (point[1] - ay) - (ax - point[0]) * (cy - ay))
+            if area > best_area:
+                best_area = area
+                best = point
+        self._anchor = best
+        return best
+
+    def _drain(self):
+        out = []
+        pending = self._pending
+        if self._anchor is None and pending:
+            # The first point is always kept
+            self._anchor = pending.pop(0)
+            out.append(self._anchor)
+
+        size = self.bucket_size
+        start = 0
+        while len(pending) - start >= 2 * size:
+            out.append(self._select(pending[start:start + size], pending[start + size:start + 2 * size]))
+            start += size
+
+        if start:
+            del pending[:start]
+        return out
+
+    def flush(self):
+        out = []
+        pending = self._pending
+        size = self.bucket_size
+        # Less than two buckets are left, reduce them with the last point as the final third corner
+        body = pending[:-1]
+        if len(body) > size:
+            out.append(self._select(body[:size], body[size:]))
+            body = body[size:]
+        if body:
+            out.append(self._select(body, pending[-1:]))
+        if pending:
+            # The last point is always kept
+            out.append(pending[-1])
+        self.reset()
+        return out
+
+    def reset(self):
+        super().reset()
+        self._anchor = None
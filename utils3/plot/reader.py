@@ -0,0 +1,223 @@
+"""Follow the .plt files written by the plot writers and keep rolling statistics of the y values.
+Requires NumPy."""
+import os
+from pathlib import Path
+import numpy as np
+
+_CLEAR = b"clear"
+
+# Bytes from the start of the file remembered to notice a reset that happened between two polls
+_PREFIX_SIZE = 64
+
+
+class RollingStats:
+    """Running aggregates of every value since the last reset, plus statistics over a window of the newest values."""
+
+    def __init__(self, window: int = 1024):
+        """
+        :param window: The number of newest values the windowed statistics and percentiles are computed over
+        """
+        assert window > 0, "window must be positive"
+        self.window = window
+        self._values = np.empty(window, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """Forget every value."""
+        self.count = 0
+        self.total = 0.0
+        self.min = float("nan")
+        self.max = float("nan")
+        self._next = 0
+        self._filled = 0
+
+    def update(self, values):
+        """Add a batch of values."""
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.total += float(values.sum())
+        low, high = float(values.min()), float(values.max())
+        self.min = low if self._filled == 0 else min(self.min, low)
+        self.max = high if self._filled == 0 else max(self.max, high)
+
+        if values.size >= self.window:
+            self._values[:] = values[-self.window:]
+            self._next = 0
+            self._filled = self.window
+            return
+
+        end = self._next + values.size
+        if end <= self.window:
+            self._values[self._next:end] = values
+        else:
+            split = self.window - self._next
+            self._values[self._next:] = values[:split]
+            self._values[:end - self.window] = values[split:]
+        self._next = end % self.window
+        self._filled = min(self.window, self._filled + values.size)
+
+    @property
+    def mean(self) -> float:
+        """The mean of every value since the last reset"""
+        return self.total / self.count if self.count else float("nan")
+
+    def windowed(self) -> np.ndarray:
+        """The newest values, oldest first"""
+        if self._filled < self.window:
+            return self._values[:self._filled].copy()
+        return np.roll(self._values, -self._next)
+
+    def percentile(self, q):
+        """Percentile(s) of the windowed values, q is in 0-100"""
+        if self._filled == 0:
+            return float("nan")
+        return np.percentile(self._values[:self._filled], q)
+
+    def snapshot(self, percentiles=(50, 90, 99)) -> dict:
+        """The statistics as a dict"""
+        window = self._values[:self._filled]
+        snapshot = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "window": {
+                "count": int(window.size),
+                "min": float(window.min()) if window.size else float("nan"),
+                "max": float(window.max()) if window.size else float("nan"),
+                "mean": float(window.mean()) if window.size else float("nan"),
+            }
+        }
+        for q in percentiles:
+            snapshot["window"]["p{}".format(q)] = float(self.percentile(q))
+        return snapshot
+
+
+def _parse(lines: [bytes]) -> (np.ndarray, np.ndarray):
+    if not lines:
+        return np.empty(0), np.empty(0)
+    try:
+        values = np.array(b",".join(lines).split(b","), dtype=np.float64)
+        if values.size == 2 * len(lines):
+            return values[0::2], values[1::2]
+    except ValueError:
+        pass
+
+    # Some line is malformed, fall back to parsing line by line and skip the bad ones
+    xs, ys = [], []
+    for line in lines:
+        try:
+            x, y = line.split(b",")
+            xs.append(float(x))
+            ys.append(float(y))
+        except ValueError:
+            continue
+    return np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64)
+
+
+class PlotTailReader:
+    """Incrementally read a .plt file. Each poll only parses the lines appended since the previous poll.
+    A 'clear' line, a truncated or replaced file restarts reading from the beginning and resets the statistics.
+
+    Note: A reset followed by enough writes to grow past the previous read position before the next poll is
+    only noticed when the start of the file differs from what was read before."""
+
+    def __init__(self, file_path: str, window: int = 1024):
+        """
+        :param file_path: The plot file to follow
+        :param window: The window of the rolling statistics, see RollingStats
+        """
+        self.file_path = Path(file_path)
+        self.stats = RollingStats(window)
+        self.resets = 0
+        self._file = None
+        self._inode = None
+        self._restart()
+
+    def _restart(self):
+        self.offset = 0
+        self._partial = b""
+        self._prefix = b""
+        self.stats.reset()
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            self._file = open(self.file_path, "rb")
+        except FileNotFoundError:
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        return True
+
+    def _changed(self) -> bool:
+        """Was the file reset, truncated or replaced since the last poll"""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return self._file is not None
+        if self._file is None or stat.st_ino != self._inode:
+            return True
+        if stat.st_size < self.offset:
+            return True
+        if self._prefix:
+            self._file.seek(0)
+            return self._file.read(len(self._prefix)) != self._prefix
+        return False
+
+    def poll(self) -> (np.ndarray, np.ndarray, bool):
+        """Read the points appended since the last poll.
+
+        :return: The new x values, the new y values and whether the plot was cleared since the last poll
+        """
+        cleared = False
+        if self._changed():
+            cleared = self.offset > 0
+            self._restart()
+            self.close()
+        if self._file is None and not self._open():
+            return np.empty(0), np.empty(0), cleared
+
+        start = self.offset
+        self._file.seek(start)
+        chunk = self._file.read()
+        if start < _PREFIX_SIZE:
+            self._prefix = (self._prefix + chunk)[:_PREFIX_SIZE]
+        self.offset += len(chunk)
+
+        data = self._partial + chunk
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+        lines = data[:end].split(b"\n")[:-1]
+
+        # Only the points after the last 'clear' belong to the current plot, the first line of the file is the header
+        for index in range(len(lines) - 1, -1, -1):
+            if lines[index].strip() == _CLEAR:
+                if index > 0 or start > 0:
+                    cleared = True
+                self.stats.reset()
+                lines = lines[index + 1:]
+                break
+
+        if cleared:
+            self.resets += 1
+
+        xs, ys = _parse(lines)
+        self.stats.update(ys)
+        return xs, ys, cleared
+
+    def close(self):
+        """Close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
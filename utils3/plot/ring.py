@@ -0,0 +1,219 @@
+"""Fixed-size, memory-mapped ring buffer plot format.
+
+The file is a 64 byte header followed by `capacity` (x, y) float64 pairs. The header holds
+the magic, the format version, the capacity, the head (number of points written since the
+last reset), the tail (index of the oldest point still in the buffer) and the write head (the
+head the writer is filling slots up to, ahead of head while a write is in progress), all as
+uint64. The newest point is at (head - 1) % capacity. Writing a point only touches the mapping, so
+the disk footprint and the per point cost stay constant however long a metric runs."""
+import os
+import mmap
+import itertools
+from pathlib import Path
+from utils3 import plot
+
+_MAGIC = int.from_bytes(b"U3PLTRNG", "little")
+_VERSION = 1
+_HEADER_SIZE = 64
+_POINT_SIZE = 16
+
+# uint64 slots of the header
+_MAGIC_SLOT, _VERSION_SLOT, _CAPACITY_SLOT, _HEAD_SLOT, _TAIL_SLOT, _WRITE_HEAD_SLOT = range(6)
+
+# Points write_xy_many writes between two commits
+_BATCH = 1024
+
+
+def _map(file_path: Path, writable: bool):
+    with open(file_path, "r+b" if writable else "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        assert size >= _HEADER_SIZE, "{} is not a ring plot file".format(file_path)
+        mm = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+    view = memoryview(mm)
+    header = view[:_HEADER_SIZE].cast("Q")
+    if header[_MAGIC_SLOT] != _MAGIC or header[_VERSION_SLOT] != _VERSION:
+        header.release()
+        view.release()
+        mm.close()
+        raise ValueError("{} is not a ring plot file".format(file_path))
+
+    capacity = header[_CAPACITY_SLOT]
+    assert size >= _HEADER_SIZE + capacity * _POINT_SIZE, "{} is truncated".format(file_path)
+    data = view[_HEADER_SIZE:_HEADER_SIZE + capacity * _POINT_SIZE].cast("d")
+    return mm, view, header, data
+
+
+class RingPlotWriter:
+    """Append x,y points to a fixed-capacity ring buffer file, the oldest points are overwritten."""
+
+    def __init__(self, file_path: str, capacity: int = 65536):
+        """
+        :param file_path: The ring file to write to. An existing file with the same capacity is appended to,
+            anything else is replaced.
+        :param capacity: The number of points kept in the file
+        """
+        assert capacity > 0, "capacity must be positive"
+        self.file_path = Path(file_path)
+        self.capacity = capacity
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            mapped = _map(self.file_path, writable=True)
+            if mapped[2][_CAPACITY_SLOT] != capacity:
+                self._release(*mapped)
+                mapped = None
+        except (FileNotFoundError, ValueError, AssertionError):
+            mapped = None
+
+        if mapped is None:
+            self._create()
+            mapped = _map(self.file_path, writable=True)
+
+        self._mm, self._view, self._header, self._data = mapped
+        self._head = self._header[_HEAD_SLOT]
+
+    def _create(self):
+        # Built next to the target and renamed over it, readers still mapping an old file are never truncated
+        temp_path = self.file_path.with_name(self.file_path.name + ".{}.tmp".format(os.getpid()))
+        with open(temp_path, "wb") as file:
+            file.truncate(_HEADER_SIZE + self.capacity * _POINT_SIZE)
+            header = memoryview(bytearray(_HEADER_SIZE)).cast("Q")
+            header[_MAGIC_SLOT] = _MAGIC
+            header[_VERSION_SLOT] = _VERSION
+            header[_CAPACITY_SLOT] = self.capacity
+            file.write(header.tobytes())
+        os.replace(temp_path, self.file_path)
+
+    @staticmethod
+    def _release(mm, view, header, data):
+        data.release()
+        header.release()
+        view.release()
+        mm.close()
+
+    def write_xy(self, x: float, y: float):
+        """Write an x,y coordinate pair."""
+        if plot.DISABLED_PLOT:
+            return
+        head = self._head
+        self._header[_WRITE_HEAD_SLOT] = head + 1
+        index = 2 * (head % self.capacity)
+        self._data[index] = x
+        self._data[index + 1] = y
+        self._commit(head + 1)
+
+    def write_xy_many(self, xs, ys):
+        """Write many x,y coordinate pairs at once. Accepts lists, iterables or NumPy arrays."""
+        if plot.DISABLED_PLOT:
+            return
+        data = self._data
+        capacity = self.capacity
+        pairs = zip(xs, ys)
+        while True:
+            # Committed in batches that never lap themselves, readers know which slots are being overwritten
+            batch = list(itertools.islice(pairs, min(_BATCH, capacity)))
+            if not batch:
+                return
+            head = self._head
+            self._header[_WRITE_HEAD_SLOT] = head + len(batch)
+            for x, y in batch:
+                index = 2 * (head % capacity)
+                data[index] = x
+                data[index + 1] = y
+                head += 1
+            self._commit(head)
+
+    def _commit(self, head: int):
+        # The write head moves before and the head after the slots are written, a reader never takes a slot that
+        # is being overwritten for a valid point
+        self._head = head
+        self._header[_TAIL_SLOT] = max(0, head - self.capacity)
+        self._header[_HEAD_SLOT] = head
+
+    def reset(self):
+        """Forget every point in the buffer."""
+        self._head = 0
+        self._header[_HEAD_SLOT] = 0
+        self._header[_TAIL_SLOT] = 0
+        self._header[_WRITE_HEAD_SLOT] = 0
+
+    def flush(self):
+        """Ask the OS to write the mapping to disk. Readers that map the file don't need this."""
+        self._mm.flush()
+
+    def close(self):
+        """Unmap the file."""
+        if self._mm is not None:
+            self._release(self._mm, self._view, self._header, self._data)
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RingPlotReader:
+    """Map a ring buffer file written by RingPlotWriter and read the newest points."""
+
+    def __init__(self, file_path: str):
+        self.file_path = Path(file_path)
+        self._mm, self._view, self._header, self._data = _map(self.file_path, writable=False)
+        self.capacity = self._header[_CAPACITY_SLOT]
+
+    @property
+    def head(self) -> int:
+        """The number of points written since the last reset"""
+        return self._header[_HEAD_SLOT]
+
+    def latest(self, n: int = None) -> [(float, float)]:
+        """The newest n points (all points in the buffer by default), oldest first"""
+        return self._read(n, None)[0]
+
+    def since(self, head: int) -> ([(float, float)], int):
+        """The points written after the reader last saw `head`, and the new head to pass next time.
+        When the writer was reset or has overwritten points that weren't read, the whole buffer is returned."""
+        return self._read(None, head)
+
+    def _read(self, n, after):
+        while True:
+            head = self._header[_HEAD_SLOT]
+            start = max(0, head - self.capacity)
+            if n is not None:
+                start = max(start, head - n)
+            if after is not None and start <= after <= head:
+                start = after
+
+            points = self._copy(start, head)
+
+            # Slots up to the write head may have been overwritten during the copy (files of writers without a write
+            # head have 0 there). Point p lives in the slot of point p + capacity.
+            write_head = max(self._header[_HEAD_SLOT], self._header[_WRITE_HEAD_SLOT])
+            if write_head - self.capacity <= start:
+                return points, head
+
+    def _copy(self, start: int, end: int):
+        if end <= start:
+            return []
+        capacity = self.capacity
+        first = start % capacity
+        count = end - start
+        if first + count <= capacity:
+            values = self._data[2 * first:2 * (first + count)].tolist()
+        else:
+            values = self._data[2 * first:].tolist() + self._data[:2 * (first + count - capacity)].tolist()
+        return list(zip(values[0::2], values[1::2]))
+
+    def close(self):
+        """Unmap the file."""
+        if self._mm is not None:
+            RingPlotWriter._release(self._mm, self._view, self._header, self._data)
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
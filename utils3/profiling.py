@@ -0,0 +1,260 @@
+"""Profile code from inside the process, as a decorator or a context manager.
+
+Modes:
+    deterministic – cProfile, every call of the profiling thread is recorded
+    statistical   – a background thread samples the stacks of every thread with sys._current_frames()
+    memory        – tracemalloc, the allocations made while profiling, grouped by stack
+
+Results export as collapsed stacks ("frame;frame;frame count" lines, the input format of
+flamegraph.pl, speedscope and inferno) and as top-N tables. cProfile doesn't record whole
+stacks, so deterministic results only have tables; use the statistical mode for flamegraphs."""
+import io
+import sys
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+import collections
+
+DETERMINISTIC = "deterministic"
+STATISTICAL = "statistical"
+MEMORY = "memory"
+
+# Per thread: is a deterministic profile running. Only one cProfile hook can be active per thread, a nested
+# profiler would replace the outer one's hook and switch it off when it stops.
+_deterministic = threading.local()
+
+
+def _frame_name(filename: str, lineno: int, name: str) -> str:
+    # Semicolons separate frames in the collapsed format
+    return "{} ({}:{})".format(name, filename, lineno).replace(";", ":")
+
+
+class ProfileResult:
+    """The outcome of a profile. Stacks are tuples of frame names, root first."""
+
+    def __init__(self, mode: str, stacks: dict, unit: str, duration: float, stats: pstats.Stats = None):
+        """
+        :param mode: The mode that produced the result
+        :param stacks: {stack: weight}, the weight is in `unit`
+        :param unit: "samples", "seconds" or "bytes"
+        :param duration: Wall time spent profiling, in seconds
+        :param stats: The pstats.Stats of a deterministic profile
+        """
+        self.mode = mode
+        self.stacks = stacks
+        self.unit = unit
+        self.duration = duration
+        self.stats = stats
+
+    def collapsed(self) -> str:
+        """The stacks in collapsed format, one "frame;frame;frame weight" line per stack"""
+        if self.mode == DETERMINISTIC:
+            raise ValueError("Deterministic profiles only have caller -> callee edges, not whole stacks, a flamegraph "
+                             "of them would be misleading. Profile in STATISTICAL mode for collapsed stacks.")
+        # Flamegraph tools expect integer weights, seconds are written as microseconds
+        scale = 1000000 if self.unit == "seconds" else 1
+        lines = []
+        for stack, weight in sorted(self.stacks.items()):
+            weight = int(round(weight * scale))
+            if weight > 0:
+                lines.append("{} {}".format(";".join(stack), weight))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def saveCollapsed(self, file_path: str):
+        """Write the collapsed stacks to a file"""
+        with open(file_path, "w") as f:
+            f.write(self.collapsed())
+
+    def top(self, n: int = 20) -> [(str, float, float)]:
+        """The n frames with the highest weight as (frame, self weight, total weight) tuples.
+        Self weight counts the stacks a frame is the leaf of, total weight every stack it is part of.
+        Deterministic results use cProfile's own and cumulative times."""
+        if self.stats is not None:
+            rows = sorted(self.stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:n]
+            return [(_frame_name(*func), own, cumulative) for func, (_, _, own, cumulative, _) in rows]
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, weight in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += weight
+            for frame in set(stack):
+                total[frame] += weight
+        return [(frame, weight, total[frame]) for frame, weight in own.most_common(n)]
+
+    def table(self, n: int = 20) -> str:
+        """The top n frames as a printable table"""
+        if self.stats is not None:
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(pstats.SortKey.TIME).print_stats(n)
+            return stream.getvalue()
+
+        grand_total = sum(self.stacks.values()) or 1
+        lines = ["{:>12} {:>7} {:>12}  {}".format("self", "self%", "total", "frame")]
+        for frame, own, total in self.top(n):
+            lines.append("{:>12.6g} {:>6.1f}% {:>12.6g}  {}".format(own, 100 * own / grand_total, total, frame))
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return "<ProfileResult {}: {} stacks, {} {}>".format(
+            self.mode, len(self.stacks), sum(self.stacks.values()), self.unit)
+
+
+class profile:
+    """Profile a code block, or every call of a function.
+
+        with profile(STATISTICAL) as p:
+            serve()
+        p.result.saveCollapsed("out.folded")
+
+        @profile(DETERMINISTIC, callback=lambda result: print(result.table()))
+        def handler(): ...
+    """
+
+    def __init__(self, mode: str = DETERMINISTIC, interval: float = 0.005, callback: callable = None,
+                 frames: int = 25, all_threads: bool = True):
+        """
+        :param mode: DETERMINISTIC, STATISTICAL or MEMORY
+        :param interval: Seconds between two samples in statistical mode
+        :param callback: Called with the ProfileResult when profiling stops
+        :param frames: The number of frames kept per allocation in memory mode
+        :param all_threads: Statistical mode samples every thread, otherwise only the thread that started profiling
+        """
+        assert mode in (DETERMINISTIC, STATISTICAL, MEMORY), "Unknown profiling mode {}".format(mode)
+        self.mode = mode
+        self.interval = interval
+        self.callback = callback
+        self.frames = frames
+        self.all_threads = all_threads
+        self.result = None
+        self._profiler = None
+        self._sampler = None
+        self._stop = None
+        self._samples = None
+        self._exclude_caller = False
+
+    # Context manager
+    def start(self):
+        """Start profiling"""
+        self._start_time = time.perf_counter()
+        if self.mode == DETERMINISTIC:
+            assert not getattr(_deterministic, "active", False), \
+                "A deterministic profile is already running on this thread, they can't be nested"
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            _deterministic.active = True
+        elif self.mode == STATISTICAL:
+            self._samples = collections.Counter()
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+            self._sampler.start()
+        else:
+            self._was_tracing = tracemalloc.is_tracing()
+            if not self._was_tracing:
+                tracemalloc.start(self.frames)
+            self._snapshot = tracemalloc.take_snapshot()
+        return self
+
+    def stop(self) -> ProfileResult:
+        """Stop profiling, the result is returned and stored in .result"""
+        duration = time.perf_counter() - self._start_time
+        if self.mode == DETERMINISTIC:
+            self._profiler.disable()
+            _deterministic.active = False
+            stats = pstats.Stats(self._profiler)
+            self.result = ProfileResult(self.mode, self._call_edges(stats), "seconds", duration, stats)
+        elif self.mode == STATISTICAL:
+            self._stop.set()
+            self._sampler.join()
+            self.result = ProfileResult(self.mode, dict(self._samples), "samples", duration)
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            if not self._was_tracing:
+                tracemalloc.stop()
+            self.result = ProfileResult(self.mode, self._allocations(snapshot), "bytes", duration)
+
+        if self.callback is not None:
+            self.callback(self.result)
+        return self.result
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Decorator
+    def __call__(self, func):
+        @functools.wraps(func)
+        def profile_wrapper(*args, **kwargs):
+            if self.mode == DETERMINISTIC and getattr(_deterministic, "active", False):
+                # A recursive or nested call, the running profile already records it
+                return func(*args, **kwargs)
+            with profile(self.mode, self.interval, self.callback, self.frames, self.all_threads):
+                return func(*args, **kwargs)
+
+        return profile_wrapper
+
+    def _sample(self, target_thread: int):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or (not self.all_threads and thread_id != target_thread):
+                    continue
+                if self._exclude_caller and thread_id == target_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_frame_name(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self._samples[tuple(reversed(stack))] += 1
+
+    @staticmethod
+    def _call_edges(stats: pstats.Stats) -> dict:
+        """cProfile only keeps caller -> callee times, not whole stacks. Every function becomes a two frame
+        (caller, callee) edge weighted by its own time under that caller, roots become single frames.
+        These aren't real stacks, collapsed() refuses to export them."""
+        stacks = {}
+        for func, (calls, primitive, own, cumulative, callers) in stats.stats.items():
+            callee = _frame_name(*func)
+            if not callers:
+                stacks[(callee,)] = own
+                continue
+            total_calls = sum(edge[0] for edge in callers.values()) or 1
+            for caller, edge in callers.items():
+                stacks[(_frame_name(*caller), callee)] = own * edge[0] / total_calls
+        return stacks
+
+    def _allocations(self, snapshot) -> dict:
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        stacks = {}
+        for statistic in snapshot.compare_to(self._snapshot, "traceback"):
+            if statistic.size_diff <= 0:
+                continue
+            # tracemalloc frames have no function name
+            stack = tuple("{}:{}".format(frame.filename, frame.lineno).replace(";", ":")
+                          for frame in reversed(statistic.traceback))
+            stacks[stack] = stacks.get(stack, 0) + statistic.size_diff
+        return stacks
+
+
+def profileFor(seconds: float, mode: str = STATISTICAL, interval: float = 0.005) -> ProfileResult:
+    """Profile the running process for a number of seconds, every thread keeps running meanwhile.
+    Meant to be called from a separate thread (e.g. a debug endpoint) of a live service. cProfile only sees
+    the thread that enables it, so the deterministic mode isn't available here."""
+    assert mode != DETERMINISTIC, "Only the statistical and memory modes can profile other threads"
+    p = profile(mode, interval=interval)
+    # The calling thread only sleeps, its samples would be noise
+    p._exclude_caller = True
+    with p:
+        time.sleep(seconds)
+    return p.result
@@ -0,0 +1,252 @@
+"""Named, aggregating timers that are cheap enough to leave on in production.
+
+Every timer keeps a count, the total, minimum and maximum time and a log-bucketed histogram
+(8 buckets per power of two, so a percentile is off by at most one bucket width, 12.5%). Each thread
+records into its own shard, shards are only merged when the statistics are read."""
+import time
+import threading
+import functools
+
+# Each power of two is split into 2 ** _SUB_BITS buckets
+_SUB_BITS = 3
+_SUB_COUNT = 1 << _SUB_BITS
+
+
+def _bucket(ns: int) -> int:
+    """Histogram bucket of a duration, values below _SUB_COUNT get a bucket each"""
+    if ns < _SUB_COUNT:
+        return ns if ns > 0 else 0
+    shift = ns.bit_length() - _SUB_BITS - 1
+    return (shift + 1) * _SUB_COUNT + (ns >> shift) - _SUB_COUNT
+
+
+def _bucket_bounds(index: int) -> (int, int):
+    """The [low, high) range of durations that fall in a bucket"""
+    if index < _SUB_COUNT:
+        return index, index + 1
+    shift = index // _SUB_COUNT - 1
+    top = index % _SUB_COUNT + _SUB_COUNT
+    return top << shift, (top + 1) << shift
+
+
+class _Shard:
+    """The measurements of one timer made by one thread"""
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = {}
+
+    def add(self, ns: int):
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+        index = _bucket(ns)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: '_Shard'):
+        """Add the measurements of a shard no thread writes to anymore"""
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+
+class TimerStats:
+    """Merged statistics of a timer, all times are in nanoseconds"""
+
+    def __init__(self, name: str, shards: [_Shard]):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = {}
+        for shard in shards:
+            if not shard.count:
+                continue
+            self.count += shard.count
+            self.total += shard.total
+            self.min = shard.min if self.min is None else min(self.min, shard.min)
+            self.max = max(self.max, shard.max)
+            # dict() copies in a single step, the owning thread may be adding to it
+            for index, count in dict(shard.buckets).items():
+                self.buckets[index] = self.buckets.get(index, 0) + count
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Estimate a percentile (0-100) from the histogram, the estimate is clamped to the measured min and max"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            count = self.buckets[index]
+            if seen + count >= rank:
+                low, high = _bucket_bounds(index)
+                estimate = low + (high - low) * ((rank - seen) / count)
+                return float(min(max(estimate, self.min), self.max))
+            seen += count
+        return float(self.max)
+
+    def asDict(self, percentiles=(50, 90, 99)) -> dict:
+        """The statistics as a dict"""
+        snapshot = {
+            "count": self.count,
+            "total_ns": self.total,
+            "mean_ns": self.mean,
+            "min_ns": self.min or 0,
+            "max_ns": self.max,
+        }
+        for q in percentiles:
+            snapshot["p{}_ns".format(q)] = self.percentile(q)
+        return snapshot
+
+    def __repr__(self):
+        return "<TimerStats {}: count={} mean={:.0f}ns p50={:.0f}ns p99={:.0f}ns>".format(
+            self.name, self.count, self.mean, self.percentile(50), self.percentile(99))
+
+
+class _NamedTimer:
+    """Time a code block or every call of a function under a timer name"""
+
+    def __init__(self, registry, name: str):
+        self._registry = registry
+        self.name = name
+        # Start times of the open 'with' blocks per thread, one timer can be shared by threads and nested
+        self._local = threading.local()
+
+    def __enter__(self):
+        try:
+            starts = self._local.starts
+        except AttributeError:
+            starts = self._local.starts = []
+        starts.append(time.perf_counter_ns())
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter_ns()
+        self._registry.record(self.name, end - self._local.starts.pop())
+
+    def __call__(self, func):
+        record = self._registry.record
+        name = self.name
+
+        @functools.wraps(func)
+        def timed_wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter_ns() - start)
+
+        return timed_wrapper
+
+
+class TimerRegistry:
+    """A collection of named timers. Recording is lock free, each thread writes to its own shards.
+    Shards of threads that have exited are folded into one retired shard per timer, so threads coming and going
+    don't grow the registry."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # name -> [(owning thread, shard)]
+        self._shards = {}
+        # name -> the merged shards of exited threads
+        self._retired = {}
+        # name -> number of shards at which dead threads are looked for again
+        self._prune_at = {}
+
+    def _prune(self, name: str):
+        """Fold the shards of exited threads into the retired shard, call with the lock held"""
+        live = []
+        retired = self._retired.setdefault(name, _Shard())
+        for thread, shard in self._shards[name]:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                retired.merge(shard)
+        self._shards[name] = live
+        self._prune_at[name] = max(16, 2 * len(live))
+
+    def _shard(self, name: str) -> _Shard:
+        try:
+            shards = self._local.shards
+        except AttributeError:
+            shards = self._local.shards = {}
+
+        shard = _Shard()
+        with self._lock:
+            owned = self._shards.setdefault(name, [])
+            if len(owned) >= self._prune_at.get(name, 16):
+                self._prune(name)
+            self._shards[name].append((threading.current_thread(), shard))
+        shards[name] = shard
+        return shard
+
+    def record(self, name: str, ns: int):
+        """Record a duration in nanoseconds"""
+        try:
+            shard = self._local.shards[name]
+        except (AttributeError, KeyError):
+            shard = self._shard(name)
+        shard.add(ns)
+
+    def timer(self, name: str) -> _NamedTimer:
+        """A context manager and decorator recording to the named timer"""
+        return _NamedTimer(self, name)
+
+    def names(self) -> [str]:
+        with self._lock:
+            return list(self._shards)
+
+    def stats(self, name: str) -> TimerStats:
+        """The statistics of a timer, merged over every thread"""
+        with self._lock:
+            if name not in self._shards:
+                return TimerStats(name, [])
+            self._prune(name)
+            shards = [self._retired[name]] + [shard for _, shard in self._shards[name]]
+        return TimerStats(name, shards)
+
+    def snapshot(self, percentiles=(50, 90, 99)) -> dict:
+        """The statistics of every timer as a dict of dicts"""
+        return {name: self.stats(name).asDict(percentiles) for name in self.names()}
+
+    def reset(self, name: str = None):
+        """Forget the measurements of one or all timers"""
+        with self._lock:
+            names = [name] if name is not None else list(self._shards)
+            for timer_name in names:
+                for _, shard in self._shards.get(timer_name, []):
+                    shard.__init__()
+                if timer_name in self._retired:
+                    self._retired[timer_name].__init__()
+
+
+timers = TimerRegistry()
+
+
+def timed(name=None):
+    """Record every call of a function (or a 'with' block) in the default registry.
+    Use as @timed, @timed("name") or 'with timed("name"):'. Without a name, functions are timed under their
+    qualified name."""
+    if callable(name):
+        return timers.timer(name.__qualname__)(name)
+    if name is None:
+        return lambda func: timers.timer(func.__qualname__)(func)
+    return timers.timer(name)
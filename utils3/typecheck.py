@@ -0,0 +1,127 @@
+"""Build argument type checkers from a function's annotations, once, at decoration time.
+
+The checker is generated Python source with the same signature as the function, so binding
+positional, keyword and default arguments is done by the interpreter itself and every
+annotated parameter costs one isinstance() call."""
+import types
+import typing
+import inspect
+import functools
+
+# Prefix of every name the generated wrapper uses, builtins included, parameters can't start with it
+_PREFIX = "_u3_"
+
+
+def _checkable(annotation):
+    """The type (or tuple of types) an annotation can be checked with isinstance, or None"""
+    if annotation is inspect.Parameter.empty or annotation is typing.Any:
+        return None
+    checked = None
+    if annotation is None:
+        checked = type(None)
+    elif isinstance(annotation, type) and typing.get_origin(annotation) is None:
+        checked = annotation
+    elif typing.get_origin(annotation) in (typing.Union, getattr(types, "UnionType", typing.Union)):
+        members = tuple(_checkable(arg) for arg in typing.get_args(annotation))
+        if all(isinstance(member, type) for member in members):
+            checked = members
+    # Generics (list[int]), TypeVars, strings that didn't resolve, ... aren't checked
+    if checked is None:
+        return None
+    try:
+        # Some classes refuse isinstance(), e.g. Protocols that aren't runtime_checkable
+        isinstance(None, checked)
+    except TypeError:
+        return None
+    return checked
+
+
+def _converter(checked):
+    """The callable used to convert a value that isn't of the checked type"""
+    if isinstance(checked, tuple):
+        for member in checked:
+            if member is not type(None):
+                return member
+    return checked
+
+
+def compileTypeChecker(function, auto_convert: bool = True):
+    """Wrap a function so its annotated arguments are checked (and converted when auto_convert) on every call.
+    Parameters without a usable annotation, *args and **kwargs are passed through unchecked. Default values
+    are never checked, e.g. `x: int = None` accepts the default None."""
+    try:
+        signature = inspect.signature(function, eval_str=True)
+    except (NameError, TypeError):
+        signature = inspect.signature(function)
+
+    namespace = {
+        _PREFIX + "function": function,
+        _PREFIX + "isinstance": isinstance,
+        _PREFIX + "TypeError": TypeError,
+        _PREFIX + "ValueError": ValueError,
+    }
+    parameters = []
+    call = []
+    checks = []
+    seen_keyword_only = False
+    seen_positional_only = False
+
+    for parameter in signature.parameters.values():
+        name = parameter.name
+        assert not name.startswith(_PREFIX), "Parameter names can't start with {}".format(_PREFIX)
+        kind = parameter.kind
+        if seen_positional_only and kind != parameter.POSITIONAL_ONLY:
+            parameters.append("/")
+            seen_positional_only = False
+        if kind == parameter.POSITIONAL_ONLY:
+            seen_positional_only = True
+
+        if kind == parameter.VAR_POSITIONAL:
+            parameters.append("*" + name)
+            call.append("*" + name)
+            seen_keyword_only = True
+            continue
+        if kind == parameter.VAR_KEYWORD:
+            parameters.append("**" + name)
+            call.append("**" + name)
+            continue
+        if kind == parameter.KEYWORD_ONLY and not seen_keyword_only:
+            parameters.append("*")
+            seen_keyword_only = True
+
+        default = ""
+        if parameter.default is not parameter.empty:
+            namespace[_PREFIX + "default_" + name] = parameter.default
+            default = "=" + _PREFIX + "default_" + name
+        parameters.append(name + default)
+        call.append(name + "=" + name if kind == parameter.KEYWORD_ONLY else name)
+
+        checked = _checkable(parameter.annotation)
+        if checked is None:
+            continue
+        namespace[_PREFIX + "type_" + name] = checked
+        namespace[_PREFIX + "convert_" + name] = _converter(checked)
+        message = "Argument {} must be of type {}".format(name, checked)
+
+        condition = "not {1}isinstance({0}, {1}type_{0})".format(name, _PREFIX)
+        if default:
+            condition = "{0} is not {1}default_{0} and {2}".format(name, _PREFIX, condition)
+        checks.append("    if {}:".format(condition))
+        if auto_convert:
+            checks.append("        try:")
+            checks.append("            {0} = {1}convert_{0}({0})".format(name, _PREFIX))
+            checks.append("        except ({0}ValueError, {0}TypeError):".format(_PREFIX))
+            checks.append("            raise {}TypeError({!r}) from None".format(_PREFIX, message))
+        else:
+            checks.append("        raise {}TypeError({!r})".format(_PREFIX, message))
+
+    if seen_positional_only:
+        parameters.append("/")
+
+    source = "\n".join([
+        "def assertWrapper({}):".format(", ".join(parameters)),
+        *checks,
+        "    return {}function({})".format(_PREFIX, ", ".join(call)),
+    ])
+    exec(compile(source, "<assertTypes {}>".format(function.__qualname__), "exec"), namespace)
+    return functools.wraps(function)(namespace["assertWrapper"])